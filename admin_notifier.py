@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from wp_guard import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Разделы сводки в порядке вывода
+CATEGORY_TITLES = {
+    'published': "✅ Опубликовано постов",
+    'updated': "✏️ Обновлено постов",
+    'error': "❌ Ошибки",
+    'info': "ℹ️ Прочие уведомления",
+}
+
+MESSAGE_LIMIT = 4096  # Предельная длина сообщения Telegram
+SUMMARY_LIMIT = 300
+MAX_DELIVERY_ATTEMPTS = 3
+
+
+class AdminNotifier:
+    """Уведомления администратору без лавины сообщений.
+
+    Первое уведомление отправляется сразу, а следующие в течение window секунд
+    собираются в одну сводку: число событий по разделам, ссылки на посты и ошибки,
+    одинаковые ошибки объединяются со счетчиком. Срочное уведомление отправляется
+    сразу, если за последние window секунд не было другого срочного уведомления того же
+    раздела, иначе тоже попадает в сводку. Сообщения отправляются не чаще rate в секунду
+    с запасом burst (Telegram ограничивает частоту сообщений в один чат), при ответе
+    429 отправка ждет время, указанное Telegram. window = 0 отключает сводки.
+    """
+
+    def __init__(self, send, window=30.0, rate=1.0, burst=3, max_items=10):
+        self.send = send
+        self.window = window
+        self.max_items = max_items
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self._entries = {}
+        self._window_timer = None
+        self._urgent_sent = {}
+        self._queue = None
+        self._sender = None
+
+    def pending_count(self):
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + sum(entry['count'] for entry in self._entries.values())
+
+    # text - полный текст уведомления, summary - строка о нем в сводке (по умолчанию первая строка
+    # текста); уведомления раздела с одинаковой summary объединяются
+    def notify(self, text, category='info', summary=None, urgent=False):
+        if self.window <= 0:
+            self._submit(text)
+            return
+
+        now = time.monotonic()
+        if urgent:
+            if now - self._urgent_sent.get(category, float('-inf')) >= self.window:
+                self._urgent_sent[category] = now
+                self._submit(text)
+                return
+        elif self._window_timer is None:
+            # Окно не открыто: событий давно не было, сообщаем сразу
+            self._open_window()
+            self._submit(text)
+            return
+
+        summary = (summary or text.split('\n')[0])[:SUMMARY_LIMIT]
+        entry = self._entries.get((category, summary))
+        if entry is None:
+            self._entries[(category, summary)] = {'category': category, 'text': text, 'summary': summary, 'count': 1}
+        else:
+            entry['count'] += 1
+
+        if self._window_timer is None:
+            self._open_window()
+
+    def _open_window(self):
+        self._window_timer = asyncio.get_running_loop().call_later(self.window, self._close_window)
+
+    # По окончании окна накопленное уходит одной сводкой, и начинается следующее окно
+    def _close_window(self):
+        self._window_timer = None
+        now = time.monotonic()
+        self._urgent_sent = {
+            category: sent for category, sent in self._urgent_sent.items() if now - sent < self.window
+        }
+        if self._entries:
+            self._submit(self._digest())
+            self._open_window()
+
+    def _digest(self):
+        entries = list(self._entries.values())
+        self._entries = {}
+        if len(entries) == 1 and entries[0]['count'] == 1:
+            return entries[0]['text']
+
+        groups = {category: [] for category in CATEGORY_TITLES}
+        for entry in entries:
+            groups.setdefault(entry['category'], []).append(entry)
+
+        lines = [f"📋 Сводка уведомлений за {self.window:.0f} сек"]
+        for category, group in groups.items():
+            if not group:
+                continue
+            lines.append("")
+            lines.append(f"{CATEGORY_TITLES.get(category, category)}: {sum(entry['count'] for entry in group)}")
+            for entry in group[:self.max_items]:
+                count = f" (×{entry['count']})" if entry['count'] > 1 else ""
+                lines.append(f"• {entry['summary']}{count}")
+            if len(group) > self.max_items:
+                lines.append(f"… и еще {len(group) - self.max_items}")
+
+        text = "\n".join(lines)
+        if len(text) > MESSAGE_LIMIT:
+            text = text[:MESSAGE_LIMIT - 1] + "…"
+        return text
+
+    def _submit(self, text):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._sender = asyncio.get_running_loop().create_task(self._run_sender())
+        self._queue.put_nowait(text[:MESSAGE_LIMIT])
+
+    async def _run_sender(self):
+        while True:
+            text = await self._queue.get()
+            try:
+                await self._deliver(text)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, text):
+        for _ in range(MAX_DELIVERY_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.send(text)
+                return
+            except Exception as e:
+                # telegram.error.RetryAfter: Telegram сообщает, сколько ждать
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None:
+                    logger.error(f"Не удалось отправить сообщение администратору: {e}")
+                    return
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Telegram ограничил частоту сообщений, повтор через {retry_after:.0f} сек")
+                self.bucket.block(retry_after)
+
+        logger.error("Не удалось отправить сообщение администратору: Telegram ограничивает частоту сообщений")
+
+    # Отправка накопленной сводки и ожидание очереди сообщений не дольше timeout секунд
+    async def close(self, timeout=10.0):
+        if self._window_timer is not None:
+            self._window_timer.cancel()
+            self._window_timer = None
+        if self._entries:
+            self._submit(self._digest())
+        if self._queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений администратору: {self._queue.qsize()}")
+        self._sender.cancel()
+        await asyncio.gather(self._sender, return_exceptions=True)
@@ -1,13 +1,25 @@
 import os
 import time
-import requests
+import secrets
+import argparse
+import asyncio
 import logging
-import threading
-from requests.auth import HTTPBasicAuth
+import functools
+import copy
+import dataclasses
+import json
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
-from datetime import datetime
 from dotenv import load_dotenv
+from wp_client import MediaRecord
+from wp_guard import CircuitBreaker, CircuitOpenError
+from outbox import Outbox, RetryLater
+from media_group_aggregator import MediaGroupAggregator
+from admin_notifier import AdminNotifier
+from targets import BACKFILL_KEY_PREFIX, PublishTarget, Route, build_targets, load_config
+import renderer
+import telegram_export
+import metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,128 +36,165 @@ BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')  # ID канала (можно получить через @username_to_id_bot)
 ADMIN_USER_ID = os.getenv('ADMIN_USER_ID')  # ID администратора для управления ботом
 
+# Уведомления администратору: события за окно собираются в сводку, частота сообщений ограничена
+admin_notifier = None
+ADMIN_NOTIFY_WINDOW = float(os.getenv('ADMIN_NOTIFY_WINDOW', '30'))
+ADMIN_NOTIFY_RATE = float(os.getenv('ADMIN_NOTIFY_RATE', '1'))
+ADMIN_NOTIFY_BURST = int(os.getenv('ADMIN_NOTIFY_BURST', '3'))
+ADMIN_NOTIFY_MAX_ITEMS = int(os.getenv('ADMIN_NOTIFY_MAX_ITEMS', '10'))
+
 # WordPress API данные
 WP_URL = os.getenv('WP_URL')
-WP_API_URL = f"{WP_URL}/wp-json/wp/v2/posts"
 WP_USERNAME = os.getenv('WP_USERNAME')
 WP_PASSWORD = os.getenv('WP_PASSWORD') 
 
-# Настройка авторизации для WordPress
-auth = HTTPBasicAuth(WP_USERNAME, WP_PASSWORD)
-headers = {"Content-Type": "application/json"}
+# Режим webhook: Telegram сам присылает обновления на HTTP-сервер бота
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')  # Публичный HTTPS-адрес, например https://example.com
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
 
-# Словарь для хранения медиа-групп и их таймеров
-media_groups = {}
-media_group_timers = {}
-stop_event = threading.Event()
+# Сколько обновлений Telegram обрабатывается одновременно
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '1'))
 
-# Функция для получения информации о медиа по ID
-def get_media_info(media_id):
-    try:
-        media_url = f"{WP_URL}/wp-json/wp/v2/media/{media_id}"
-        response = requests.get(media_url, auth=auth)
-        
-        if response.status_code == 200:
-            return response.json()
-        
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка при получении информации о медиа: {e}")
-        return None
+# Локальный HTTP-сервер метрик в формате Prometheus (METRICS_PORT=0 отключает его)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+metrics_server = None
 
-# Функция для загрузки медиа в WordPress
-async def upload_media_to_wordpress(media_url, mime_type):
-    try:
-        # Загрузка медиа
-        media_response = requests.get(media_url)
-        if media_response.status_code == 200:
-            file_name = f"telegram_media_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            file_extension = ".jpg" if mime_type == "image/jpeg" else ".mp4"
-            
-            # Загрузка медиа в WordPress
-            media_headers = {
-                "Content-Disposition": f'attachment; filename="{file_name}{file_extension}"',
-                "Content-Type": mime_type
-            }
-            
-            media_url_wp = f"{WP_URL}/wp-json/wp/v2/media"
-            media_response = requests.post(
-                media_url_wp,
-                headers=media_headers,
-                auth=auth,
-                data=media_response.content
-            )
-            
-            if media_response.status_code in [200, 201]:
-                # Получение ID загруженного медиа
-                media_id = media_response.json().get('id')
-                
-                # Ждем, пока медиа обработается WordPress
-                time.sleep(2)
-                
-                return media_id
-            else:
-                logger.error(f"Ошибка загрузки медиа в WordPress: {media_response.status_code}, {media_response.text}")
-        
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке медиа: {e}")
-        return None
+# Файл SQLite для постоянного состояния бота
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.sqlite3')
+
+# Сборщик медиа-групп, создается при запуске бота в его цикле событий
+media_group_aggregator = None
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', '5'))  # Ждем 5 секунд после последнего сообщения
+MEDIA_GROUP_MAX_ITEMS = int(os.getenv('MEDIA_GROUP_MAX_ITEMS', '10'))
+MEDIA_GROUP_MAX_PENDING = int(os.getenv('MEDIA_GROUP_MAX_PENDING', '100'))
+MEDIA_GROUP_TTL = float(os.getenv('MEDIA_GROUP_TTL', '60'))
+# Незавершенные медиа-группы сохраняются сюда при остановке и дособираются после запуска
+MEDIA_GROUP_SNAPSHOT_PATH = os.getenv('MEDIA_GROUP_SNAPSHOT_PATH', 'media_groups_snapshot.json')
+# Группы из снимка, еще не поставленные в очередь публикаций
+restored_media_groups = set()
+
+# Сколько секунд остановка ждет завершения начатых публикаций и отправки уведомлений
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+# Предельное время прогрева соединений с WordPress при запуске, сек
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '15'))
+
+# Постоянная очередь публикаций: задачи переживают перезапуск и повторяются при ошибках
+outbox = Outbox(
+    STATE_DB_PATH,
+    max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8')),
+    base_delay=float(os.getenv('OUTBOX_RETRY_DELAY', '5')),
+    max_delay=float(os.getenv('OUTBOX_MAX_RETRY_DELAY', '600'))
+)
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+outbox_workers = []
+
+# Настройки сайта WordPress по умолчанию. В файле настроек их можно переопределить
+# для всех сайтов (секция defaults) или для отдельного сайта
+TARGET_DEFAULTS = {
+    # Защита WordPress от перегрузки: лимит частоты, адаптивное число одновременных
+    # запросов и автомат, приостанавливающий запросы, пока сайт недоступен
+    'rate_limit': os.getenv('WP_RATE_LIMIT', '10'),
+    'rate_burst': os.getenv('WP_RATE_BURST', '20'),
+    'concurrency_initial': os.getenv('WP_CONCURRENCY_INITIAL', '4'),
+    'concurrency_max': os.getenv('WP_CONCURRENCY_MAX', '16'),
+    'latency_target': os.getenv('WP_LATENCY_TARGET', '2'),
+    'breaker_threshold': os.getenv('WP_BREAKER_THRESHOLD', '5'),
+    'breaker_reset': os.getenv('WP_BREAKER_RESET', '30'),
+    'breaker_max_reset': os.getenv('WP_BREAKER_MAX_RESET', '300'),
+    # Асинхронный клиент WordPress с пулом keep-alive соединений
+    'max_connections': os.getenv('WP_MAX_CONNECTIONS', '10'),
+    'max_keepalive_connections': os.getenv('WP_MAX_KEEPALIVE_CONNECTIONS', '5'),
+    'timeout': os.getenv('WP_TIMEOUT', '60'),
+    'connect_timeout': os.getenv('WP_CONNECT_TIMEOUT', '10'),
+    'media_ready_timeout': os.getenv('WP_MEDIA_READY_TIMEOUT', '10'),
+    'media_ready_initial_delay': os.getenv('WP_MEDIA_READY_INITIAL_DELAY', '0.2'),
+    'media_ready_max_delay': os.getenv('WP_MEDIA_READY_MAX_DELAY', '2'),
+    'upload_mode': os.getenv('WP_UPLOAD_MODE', 'stream'),
+    'upload_chunk_size': os.getenv('WP_UPLOAD_CHUNK_SIZE', str(256 * 1024)),
+    'media_cache_ttl': os.getenv('WP_MEDIA_CACHE_TTL', '300'),
+    # Кэш уже загруженных файлов Telegram, чтобы не загружать повторы и пересылки заново
+    'media_cache_max_entries': os.getenv('MEDIA_CACHE_MAX_ENTRIES', '10000'),
+    # Число обработчиков очереди и одновременных загрузок элементов альбома
+    'workers': OUTBOX_WORKERS,
+    'upload_concurrency': os.getenv('MEDIA_UPLOAD_CONCURRENCY', '4'),
+}
+
+# Файл настроек (YAML или TOML) с несколькими каналами и сайтами. Без него бот публикует
+# один канал TELEGRAM_CHANNEL_ID на один сайт WP_URL
+TARGETS_CONFIG = os.getenv('TARGETS_CONFIG')
+if TARGETS_CONFIG:
+    targets, channel_routes = build_targets(load_config(TARGETS_CONFIG), STATE_DB_PATH, TARGET_DEFAULTS)
+else:
+    targets = {'default': PublishTarget('default', WP_URL, WP_USERNAME, WP_PASSWORD, STATE_DB_PATH, TARGET_DEFAULTS)}
+    channel_routes = {CHANNEL_ID: [Route(targets['default'])]} if CHANNEL_ID else {}
+
+# Правки одного поста применяются по очереди. Блокировки общие для групп постов
+# (по хэшу ключа), поэтому их число не растет с числом опубликованных постов
+post_edit_locks = [asyncio.Lock() for _ in range(64)]
+
+def post_edit_lock(post_key):
+    return post_edit_locks[hash(post_key) % len(post_edit_locks)]
+
+# Медиа из кэша, если оно еще есть в медиатеке WordPress. Записи об удаленном
+# в WordPress медиа убираются из кэша, и файл загружается заново
+async def verified_media(target, media):
+    if media is None or await target.client.media_exists(media.id):
+        return media
+
+    logger.warning(f"Медиа {media.id} удалено из WordPress, загружаем заново")
+    target.media_cache.discard(media.id)
+    return None
+
+# Поиск уже загруженного медиа по SHA-256 содержимого
+async def find_media_by_hash(target, content_hash):
+    return await verified_media(target, target.media_cache.get_by_hash(content_hash))
+
+# Функция для загрузки медиа в WordPress, возвращает MediaRecord
+async def upload_media_to_wordpress(target, media_url, mime_type):
+    find_by_hash = functools.partial(find_media_by_hash, target)
+    return await target.client.upload_media(media_url, mime_type, find_by_hash=find_by_hash)
+
+# Загрузка файла Telegram в WordPress с проверкой кэша: при попадании файл не скачивается
+async def upload_telegram_media(bot, target, file_id, file_unique_id, mime_type):
+    media = await verified_media(target, target.media_cache.get(file_unique_id))
+    if media:
+        logger.info(f"Медиа {file_unique_id} уже загружено в WordPress: {media.id}")
+        return media
+    
+    with metrics.track_stage("telegram_get_file"):
+        file = await bot.get_file(file_id)
+    media = await upload_media_to_wordpress(target, file.file_path, mime_type)
+    target.media_cache.put(file_unique_id, media)
+    return media
 
 # Функция для публикации поста в WordPress
-async def post_to_wordpress(title, content, featured_media_id=None):
-    try:
-        # Подготовка данных поста
-        post_data = {
-            "title": title,
-            "content": content,
-            "status": "publish"
-        }
-        
-        # Если есть медиа для миниатюры, добавим его
-        if featured_media_id:
-            post_data["featured_media"] = featured_media_id
-        
-        # Отправка запроса на создание поста
-        response = requests.post(WP_API_URL, headers=headers, auth=auth, json=post_data)
-        
-        if response.status_code == 201:
-            logger.info(f"Пост успешно создан: {response.json().get('link')}")
-            return True, response.json().get('link')
-        else:
-            logger.error(f"Ошибка создания поста: {response.status_code}, {response.text}")
-            return False, None
-    except Exception as e:
-        logger.error(f"Ошибка при публикации поста: {e}")
-        return False, None
+async def post_to_wordpress(target, title, content, featured_media_id=None, date=None, categories=None, tags=None):
+    return await target.client.create_post(title, content, featured_media_id, date, categories, tags)
 
 # Функция для проверки соединения с WordPress
-async def check_wordpress_connection():
-    try:
-        response = requests.get(f"{WP_URL}/wp-json", timeout=10)
-        if response.status_code == 200:
-            logger.info("Соединение с WordPress установлено успешно.")
-            return True
-        else:
-            logger.error(f"Ошибка соединения с WordPress: {response.status_code}")
-            return False
-    except Exception as e:
-        logger.error(f"Ошибка при подключении к WordPress: {e}")
-        return False
+async def check_wordpress_connection(target):
+    return await target.client.check_connection()
 
-# Функция для безопасной отправки сообщения администратору
+# Отправка сообщения администратору; повторы при ограничении частоты и ошибки обрабатывает AdminNotifier
 async def send_admin_message(bot, text):
-    try:
-        # Проверяем, что ADMIN_USER_ID корректный
-        if not ADMIN_USER_ID or ADMIN_USER_ID == "":
-            logger.warning("ADMIN_USER_ID не установлен в .env файле")
-            return False
-        
+    with metrics.track_stage("admin_notify"):
         await bot.send_message(chat_id=ADMIN_USER_ID, text=text)
-        return True
-    except Exception as e:
-        logger.error(f"Не удалось отправить сообщение администратору: {e}")
-        return False
+
+# Уведомление администратора через сборщик сводок. category - раздел сводки,
+# summary - строка о событии в сводке, urgent - отправить сразу
+def notify_admin(text, category='info', summary=None, urgent=False):
+    # Проверяем, что ADMIN_USER_ID корректный
+    if not ADMIN_USER_ID:
+        logger.warning("ADMIN_USER_ID не установлен в .env файле")
+        return
+    if admin_notifier is None:
+        logger.info(f"Уведомление администратору не отправлено (бот не запущен): {text}")
+        return
+    admin_notifier.notify(text, category, summary, urgent)
 
 # Обработчик команды /start
 async def start(update: Update, context: CallbackContext):
@@ -156,7 +205,9 @@ async def start(update: Update, context: CallbackContext):
     
     await update.message.reply_text(
         "Привет! Я бот для интеграции Telegram канала с WordPress.\n"
-        "Используйте /status для проверки соединения.\n"
+        "Используйте /status для проверки соединения и /metrics для просмотра метрик.\n"
+        "Команда /unpublish <ID сообщения> перемещает опубликованный пост в корзину.\n"
+        "Команда /dead показывает неудавшиеся публикации, /retry <ключ> или /retry all повторяет их.\n"
         "Я автоматически буду публиковать посты из канала на сайт."
     )
 
@@ -167,268 +218,942 @@ async def status(update: Update, context: CallbackContext):
         await update.message.reply_text("Извините, у вас нет доступа к этому боту.")
         return
     
-    wp_status = await check_wordpress_connection()
+    lines = []
+    for name, target in targets.items():
+        wp_status = await check_wordpress_connection(target)
+        prefix = f"{name}: " if len(targets) > 1 else ""
+        if wp_status:
+            lines.append(f"✅ {prefix}WordPress подключен успешно.")
+        else:
+            lines.append(f"❌ {prefix}Ошибка подключения к WordPress.")
     
-    if wp_status:
-        await update.message.reply_text("✅ WordPress подключен успешно.")
-    else:
-        await update.message.reply_text("❌ Ошибка подключения к WordPress.")
+    await update.message.reply_text("\n".join(lines))
 
-# Функция для обработки медиа-группы
-async def process_media_group(bot, media_group_id):
-    global media_groups
+class PublishError(Exception):
+    """Публикация не удалась, задача будет повторена"""
+
+# Обработчик команды /metrics
+async def metrics_command(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if str(user_id) != ADMIN_USER_ID:
+        await update.message.reply_text("Извините, у вас нет доступа к этому боту.")
+        return
+    
+    await update.message.reply_text("📊 Метрики публикации:\n" + metrics.summary())
+
+# Обработчик команды /unpublish <ID сообщения> [ID канала]: посты на всех сайтах канала
+# перемещаются в корзину WordPress. Telegram не сообщает ботам об удалении сообщений
+# в канале, поэтому удаление выполняется вручную
+async def unpublish(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if str(user_id) != ADMIN_USER_ID:
+        await update.message.reply_text("Извините, у вас нет доступа к этому боту.")
+        return
     
-    if media_group_id not in media_groups:
-        logger.error(f"Медиа-группа {media_group_id} не найдена")
+    args = context.args
+    chat_id = args[1] if len(args) == 2 else (next(iter(channel_routes)) if len(channel_routes) == 1 else None)
+    if len(args) not in (1, 2) or not args[0].isdigit() or chat_id not in channel_routes:
+        await update.message.reply_text(
+            "Использование: /unpublish <ID сообщения в канале> [ID канала]\n"
+            "Для альбома укажите ID его первого сообщения. ID канала нужен, если каналов несколько."
+        )
         return
     
-    media_group = media_groups[media_group_id]
-    logger.info(f"Обработка медиа-группы {media_group_id} с {len(media_group['media'])} элементами")
+    replies = []
+    for route in channel_routes[chat_id]:
+        target = route.target
+        mapping = target.post_map.find_by_message(int(chat_id), int(args[0]))
+        if mapping is None:
+            replies.append("❌ Пост для этого сообщения не найден.")
+        elif mapping['status'] == 'trashed':
+            replies.append(f"Пост уже в корзине: {mapping['link']}")
+        elif await target.client.trash_post(mapping['post_id']):
+            target.post_map.set_status(mapping['key'], 'trashed')
+            replies.append(f"🗑 Пост перемещен в корзину: {mapping['link']}")
+        else:
+            replies.append("❌ Не удалось удалить пост, подробности в логе.")
+        if len(targets) > 1:
+            replies[-1] = f"{target.name}: {replies[-1]}"
     
-    # Создаем галерею из изображений и видео
-    gallery_html = '<div class="wp-block-gallery"><ul class="blocks-gallery-grid">'
-    media_ids = []
+    await update.message.reply_text("\n".join(replies))
+
+# Обработчик команды /dead: задачи, для которых закончились попытки
+async def dead(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if str(user_id) != ADMIN_USER_ID:
+        await update.message.reply_text("Извините, у вас нет доступа к этому боту.")
+        return
     
-    for item in media_group['media']:
-        media_type = item['type']
-        media_url = item['url']
-        
-        mime_type = "image/jpeg" if media_type == 'photo' else "video/mp4"
-        media_id = await upload_media_to_wordpress(media_url, mime_type)
-        
-        if media_id:
-            media_ids.append(media_id)
-            
-            if media_type == 'photo':
-                # Получаем URL изображения из WordPress
-                media_info = get_media_info(media_id)
-                if media_info and 'source_url' in media_info:
-                    gallery_html += f'<li class="blocks-gallery-item"><figure><img src="{media_info["source_url"]}" alt=""/></figure></li>'
-    
-    gallery_html += '</ul></div>'
-    
-    # Создаем контент с галереей и текстом
-    html_content = """
-    {0}
-    <div class="telegram-post">
-        {1}
-        <br><br>
-        <a href="https://t.me/{2}/{3}" class="telegram-link">Перейти в Telegram</a>
-    </div>
-    """.format(gallery_html, media_group['text'].replace('\n', '<br>') if media_group['text'] else "", 
-               media_group['channel_username'], media_group['message_id'])
-    
-    # Публикация в WordPress с первым изображением как миниатюрой (если есть)
-    featured_media_id = media_ids[0] if media_ids else None
-    success, post_url = await post_to_wordpress(media_group['title'], html_content, featured_media_id)
+    jobs = outbox.dead_letters(limit=20)
+    if not jobs:
+        await update.message.reply_text("Неудавшихся публикаций нет.")
+        return
     
-    # Отправка сообщения администратору о результате
-    if success:
-        await send_admin_message(
-            bot,
-            f"✅ Новый пост с медиа-группой успешно опубликован на сайте!\nЗаголовок: {media_group['title']}\nСсылка: {post_url}"
-        )
+    lines = [f"❌ Неудавшиеся публикации (последние {len(jobs)}):"]
+    for job in jobs:
+        lines.append(f"• {job['key']} (попыток: {job['attempts']}): {(job['last_error'] or '')[:200]}")
+    lines.append("Повторить: /retry <ключ> или /retry all")
+    await update.message.reply_text("\n".join(lines)[:4096])
+
+# Обработчик команды /retry <ключ> | all: возврат неудавшихся публикаций в очередь
+async def retry(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if str(user_id) != ADMIN_USER_ID:
+        await update.message.reply_text("Извините, у вас нет доступа к этому боту.")
+        return
+    
+    if len(context.args) != 1:
+        await update.message.reply_text("Использование: /retry <ключ задачи из /dead> или /retry all")
+        return
+    
+    count = outbox.requeue(None if context.args[0] == 'all' else context.args[0])
+    if count:
+        await update.message.reply_text(f"🔁 Возвращено в очередь задач: {count}")
     else:
-        await send_admin_message(
-            bot,
-            f"❌ Не удалось опубликовать пост с медиа-группой на сайт.\nЗаголовок: {media_group['title']}"
-        )
+        await update.message.reply_text("❌ Неудавшаяся задача с таким ключом не найдена.")
+
+# Загрузка локального файла (из экспорта истории канала) с проверкой кэша по хэшу содержимого
+async def upload_local_media(target, path, mime_type):
+    find_by_hash = functools.partial(find_media_by_hash, target)
+    media = await target.client.upload_file(path, mime_type, find_by_hash=find_by_hash)
+    if media and media.content_hash:
+        target.media_cache.put(f"sha256:{media.content_hash}", media)
+    return media
+
+# Загрузка одного медиа публикации с ограничением числа одновременных загрузок
+async def upload_media_item(bot, target, item):
+    mime_type = item.get('mime_type') or ("image/jpeg" if item['type'] == 'photo' else "video/mp4")
     
-    # Удаляем обработанную медиа-группу и её таймер
-    if media_group_id in media_groups:
-        del media_groups[media_group_id]
+    async with target.upload_semaphore:
+        metrics.IN_FLIGHT_UPLOADS.inc()
+        try:
+            if 'path' in item:
+                return await upload_local_media(target, item['path'], mime_type)
+            return await upload_telegram_media(bot, target, item['file_id'], item['file_unique_id'], mime_type)
+        finally:
+            metrics.IN_FLIGHT_UPLOADS.dec()
+
+# Сборка разметки поста из данных задачи и загруженных медиа
+def build_post_content(payload, media_records):
+    # Медиа-группа публикуется галереей, одиночное фото или видео добавляется перед текстом
+    return renderer.render_post(
+        payload['text'],
+        payload.get('entities'),
+        payload['channel_username'],
+        payload['message_id'],
+        [(item['type'], media) for item, media in zip(payload['media'], media_records)],
+        gallery=bool(payload['media_group_id'])
+    )
+
+# Выполнение задачи публикации или правки из очереди. Пока WordPress недоступен,
+# задача откладывается без учета попытки, чтобы не уйти в список неудачных
+async def publish_job(bot, target, job):
+    # target - сайт обработчика, взявшего задачу. Задачи, поставленные до появления нескольких
+    # сайтов (без сайта или с сайтом default), выполняет сайт с пустым префиксом ключей
+    name = job['payload'].get('target', 'default')
+    if name != target.name and not (name == 'default' and not target.key_prefix):
+        raise PublishError(f"Сайт {name} не настроен")
     
-    if media_group_id in media_group_timers:
-        del media_group_timers[media_group_id]
+    try:
+        if job['payload'].get('kind') == 'edit':
+            await _edit_job(bot, target, job)
+        else:
+            await _publish_job(bot, target, job)
+    except CircuitOpenError as e:
+        raise RetryLater(e.retry_after, str(e)) from e
 
-# Функция таймера для отложенной обработки медиа-группы
-def delayed_media_group_processing(bot, media_group_id):
-    """Функция для запуска асинхронного процесса обработки медиа-группы через Threading"""
-    async def _process():
-        await process_media_group(bot, media_group_id)
+async def _publish_job(bot, target, job):
+    payload = job['payload']
+    progress = job['progress']
+    
+    if payload['media_group_id']:
+        logger.info(f"Обработка медиа-группы {payload['media_group_id']} с {len(payload['media'])} элементами")
+    
+    # Медиа загружаются параллельно, gather сохраняет порядок Telegram
+    results = await asyncio.gather(
+        *(upload_media_item(bot, target, item) for item in payload['media']),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, CircuitOpenError):
+            raise result
+        if isinstance(result, Exception):
+            raise PublishError(f"Не удалось загрузить медиа: {result}") from result
+        if not result:
+            raise PublishError("Не удалось загрузить медиа в WordPress")
+    
+    html_content = build_post_content(payload, results)
+    
+    # Первое медиа становится миниатюрой поста
+    featured_media_id = results[0].id if results else None
+    
+    # Если прошлая попытка успела отправить запрос на создание поста,
+    # сначала ищем этот пост, чтобы не создать дубликат
+    telegram_link = f"https://t.me/{payload['channel_username']}/{payload['message_id']}"
+    post = None
+    if progress.get('post_started'):
+        post = await target.client.find_post_by_link(telegram_link)
+        if post:
+            logger.info(f"Пост для {job['key']} уже создан прошлой попыткой: {post.get('link')}")
+    
+    if not post:
+        outbox.save_progress(job['key'], {**progress, 'post_started': True})
+        success, post = await post_to_wordpress(
+            target,
+            payload['title'],
+            html_content,
+            featured_media_id,
+            payload.get('date'),
+            payload.get('categories'),
+            payload.get('tags')
+        )
+        if not success:
+            raise PublishError("WordPress не создал пост")
+    
+    # Пост запоминается под ключом обычной публикации, в том числе при импорте истории,
+    # чтобы правки сообщения находили его
+    post_url = post.get('link')
+    target.post_map.save(target.job_key(publish_job_key(payload)), payload, post['id'], post_url, [dataclasses.asdict(media) for media in results])
+    
+    # Об импорте истории администратор получает только итог
+    if payload.get('source') == 'backfill':
+        return
     
-    import asyncio
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(_process())
-    loop.close()
+    # Отправка сообщения администратору о результате
+    source = "с медиа-группой" if payload['media_group_id'] else "с канала"
+    notify_admin(
+        f"✅ Новый пост {source} успешно опубликован на сайте!\nЗаголовок: {payload['title']}\nСсылка: {post_url}",
+        'published',
+        f"{payload['title']} — {post_url}"
+    )
 
-# Обработчик новых сообщений в канале
-async def channel_post(update: Update, context: CallbackContext):
-    global media_groups, media_group_timers
+# Перенос правки сообщения в уже опубликованный пост: медиа загружаются только новые,
+# в WordPress отправляются только изменившиеся поля
+async def _edit_job(bot, target, job):
+    edit = job['payload']['edit']
+    post_key = job['payload']['post_key']
     
-    message = update.channel_post
+    async with post_edit_lock(post_key):
+        mapping = target.post_map.get(post_key)
+        if mapping is None:
+            raise PublishError("Исходный пост еще не опубликован")
+        if mapping['status'] == 'trashed':
+            logger.info(f"Пост для {post_key} в корзине, правка пропущена")
+            return
+        
+        old_payload = mapping['payload']
+        if old_payload.get('edited_at', {}).get(str(edit['message_id']), 0) >= edit['edit_date']:
+            logger.info(f"Правка {job['key']} устарела, пропускаем")
+            return
+        
+        payload = copy.deepcopy(old_payload)
+        apply_message_edit(payload, edit)
+        payload.setdefault('edited_at', {})[str(edit['message_id'])] = edit['edit_date']
+        route = find_route(payload['chat_id'], target.name)
+        if route is not None:
+            payload['categories'], payload['tags'] = route.taxonomy(payload['text'], payload.get('entities'))
+        
+        old_records = [MediaRecord(**media) for media in mapping['media']]
+        # Медиа из экспорта истории не имеют file_unique_id
+        uploaded = {
+            item['file_unique_id']: media
+            for item, media in zip(old_payload['media'], old_records) if item.get('file_unique_id')
+        }
+        
+        async def media_for(item):
+            if item.get('file_unique_id') in uploaded:
+                return uploaded[item['file_unique_id']]
+            return await upload_media_item(bot, target, item)
+        
+        results = await asyncio.gather(*(media_for(item) for item in payload['media']), return_exceptions=True)
+        for result in results:
+            if isinstance(result, CircuitOpenError):
+                raise result
+            if isinstance(result, Exception):
+                raise PublishError(f"Не удалось загрузить медиа: {result}") from result
+            if not result:
+                raise PublishError("Не удалось загрузить медиа в WordPress")
+        
+        fields = {}
+        if payload['title'] != old_payload['title']:
+            fields['title'] = payload['title']
+        content = build_post_content(payload, results)
+        if content != build_post_content(old_payload, old_records):
+            fields['content'] = content
+        featured_media_id = results[0].id if results else 0
+        if featured_media_id != (old_records[0].id if old_records else 0):
+            fields['featured_media'] = featured_media_id
+        for taxonomy in ('categories', 'tags'):
+            if payload.get(taxonomy, []) != old_payload.get(taxonomy, []):
+                fields[taxonomy] = payload.get(taxonomy, [])
+        
+        if fields:
+            post = await target.client.update_post(mapping['post_id'], fields)
+            if post is None:
+                raise PublishError("WordPress не обновил пост")
+        else:
+            logger.info(f"Правка {job['key']} не меняет пост {mapping['post_id']}")
+        
+        target.post_map.save(
+            post_key, payload, mapping['post_id'], mapping['link'], [dataclasses.asdict(media) for media in results]
+        )
     
-    # Проверяем, что сообщение пришло из нужного канала
-    if str(message.chat.id) != CHANNEL_ID:
+    if fields:
+        notify_admin(
+            f"✏️ Пост обновлен по правке в канале.\nЗаголовок: {payload['title']}\nСсылка: {mapping['link']}",
+            'updated',
+            f"{payload['title']} — {mapping['link']}"
+        )
+
+# Срочное уведомление администратора о задаче, для которой закончились попытки
+async def publish_job_dead(bot, job, error):
+    payload = job['payload']
+    if payload.get('kind') == 'edit':
+        notify_admin(
+            f"❌ Не удалось перенести правку сообщения {payload['edit']['message_id']} на сайт "
+            f"после {outbox.max_attempts} попыток.\nОшибка: {error}\nПовторить: /retry {job['key']}",
+            'error',
+            f"Правка сообщения {payload['edit']['message_id']} не перенесена: {error}",
+            urgent=True
+        )
         return
     
-    logger.info(f"Получено новое сообщение из канала: {message.chat.title}")
+    source = "с медиа-группой" if payload['media_group_id'] else "с канала"
+    notify_admin(
+        f"❌ Не удалось опубликовать пост {source} на сайт после {outbox.max_attempts} попыток.\n"
+        f"Заголовок: {payload['title']}\nОшибка: {error}\nПовторить: /retry {job['key']}",
+        'error',
+        f"Пост не опубликован: {payload['title']}: {error}",
+        urgent=True
+    )
+
+# Канал в ссылке на сообщение https://t.me/<канал>/<ID сообщения>: username публичного канала
+# или c/<ID канала без -100> для канала без username, как в ссылках, которые копирует Telegram.
+# Хранится в задачах под ключом channel_username
+def channel_link_path(chat_id, username=None):
+    if username:
+        return username
+    return f"c/{str(chat_id).removeprefix('-100')}"
+
+# Ключ идемпотентности задачи: одно сообщение или одна медиа-группа - одна публикация
+def publish_job_key(payload):
+    if payload['media_group_id']:
+        return f"{payload['chat_id']}:group:{payload['media_group_id']}"
+    return f"{payload['chat_id']}:{payload['message_id']}"
+
+# Выбор задач для обработчиков сайта: ключи с префиксом сайта, кроме задач импорта истории
+# и задач сайтов, чей префикс начинается с префикса этого сайта (для сайта с пустым префиксом - всех).
+# Для импорта истории (backfill=True) - только задачи импорта на этот сайт
+def target_key_filter(target, backfill=False):
+    base = BACKFILL_KEY_PREFIX if backfill else ""
+    exclude = [
+        base + other.key_prefix for other in targets.values()
+        if other is not target and other.key_prefix.startswith(target.key_prefix)
+    ]
+    if not backfill:
+        exclude.append(BACKFILL_KEY_PREFIX)
+    return base + target.key_prefix, exclude
+
+# Маршрут публикации канала на сайт с указанным именем
+def find_route(chat_id, target_name):
+    for route in channel_routes.get(str(chat_id), []):
+        if route.target.name == target_name:
+            return route
+    return None
+
+# Постановка публикации в очередь каждого сайта, на который публикуется канал.
+# Рубрики и метки определяются маршрутом и хэштегами сообщения
+def enqueue_publication(payload):
+    for route in channel_routes.get(str(payload['chat_id']), []):
+        categories, tags = route.taxonomy(payload['text'], payload.get('entities'))
+        job = {**payload, 'target': route.target.name, 'categories': categories, 'tags': tags}
+        if outbox.enqueue(route.target.job_key(publish_job_key(job)), job) or not payload['media_group_id']:
+            continue
+        
+        # Альбом уже поставлен в очередь (собран досрочно по MEDIA_GROUP_TTL или MEDIA_GROUP_MAX_PENDING),
+        # а это его опоздавшие сообщения: добавляем их в пост так же, как правки
+        logger.warning(
+            f"Сообщения {[item['message_id'] for item in payload['media']]} пришли после публикации "
+            f"медиа-группы {payload['media_group_id']}, добавляем их в пост"
+        )
+        for index, item in enumerate(payload['media']):
+            queue_message_edit(route, publish_job_key(payload), {
+                'message_id': item['message_id'],
+                'edit_date': time.time(),
+                'text': payload['text'] if index == 0 else "",
+                'entities': payload.get('entities', []) if index == 0 else [],
+                'title': payload['title'],
+                'item': item
+            })
+
+# Функция для обработки медиа-группы: собранная группа ставится в очередь публикации
+async def process_media_group(bot, media_group_id, media_group):
+    logger.info(f"Медиа-группа {media_group_id} собрана: {len(media_group['media'])} элементов")
     
+    payload = {
+        'chat_id': media_group['chat_id'],
+        'message_id': media_group['message_id'],
+        'media_group_id': media_group_id,
+        'title': media_group['title'],
+        'text': media_group['text'],
+        'entities': media_group.get('entities', []),
+        'channel_username': media_group['channel_username'],
+        'media': media_group['media']
+    }
+    
+    try:
+        enqueue_publication(payload)
+    except Exception as e:
+        logger.error(f"Ошибка постановки медиа-группы в очередь: {e}")
+        notify_admin(f"❌ Ошибка при обработке медиа-группы: {e}", 'error', urgent=True)
+        return
+    
+    # Снимок нужен, пока восстановленные из него группы не попали в очередь: если бот
+    # упадет раньше, они восстановятся при следующем запуске
+    if media_group_id in restored_media_groups:
+        restored_media_groups.discard(media_group_id)
+        if not restored_media_groups:
+            remove_media_group_snapshot()
+
+# Создание заголовка (первая строка или первые 100 символов)
+def post_title(text):
+    return text.split('\n')[0][:100] if text else "Новый пост"
+
+# Разбор сообщения канала: текст с сущностями форматирования, заголовок, username канала и медиа
+def parse_channel_message(message):
     # Получение текста сообщения (либо из text, либо из caption)
     text = ""
+    entities = []
     if message.text:
         text = message.text
+        entities = [entity.to_dict() for entity in message.entities]
     elif message.caption:
         text = message.caption
+        entities = [entity.to_dict() for entity in message.caption_entities]
     
-    # Создание заголовка (первая строка или первые 100 символов)
-    title = text.split('\n')[0][:100] if text else "Новый пост"
+    title = post_title(text)
     
     # Получение канала для ссылки
-    channel_username = message.chat.username or "channel"  # Если канал без username
+    channel_username = channel_link_path(message.chat.id, message.chat.username)
+    
+    # Медиа сообщения (ссылка на файл запрашивается при публикации,
+    # чтобы не обращаться к Telegram за файлами, которые уже есть в кэше)
+    item = None
+    if message.photo:
+        # Берем фото максимального размера
+        photo = message.photo[-1]
+        item = {'type': 'photo', 'file_id': photo.file_id, 'file_unique_id': photo.file_unique_id}
+    elif message.video:
+        video = message.video
+        item = {'type': 'video', 'file_id': video.file_id, 'file_unique_id': video.file_unique_id}
     
-    # Проверка на наличие медиа-группы
+    if item and message.media_group_id:
+        item['message_id'] = message.message_id
+    
+    return text, entities, title, channel_username, item
+
+# Обработчик новых сообщений в канале
+async def channel_post(update: Update, context: CallbackContext):
+    message = update.channel_post
+    
+    # Проверяем, что сообщение пришло из канала, который публикуется на сайты
+    if str(message.chat.id) not in channel_routes:
+        return
+    
+    logger.info(f"Получено новое сообщение из канала: {message.chat.title}")
+    
+    text, entities, title, channel_username, item = parse_channel_message(message)
+    
+    # Сообщения медиа-группы собираются вместе и публикуются одним постом
     if message.media_group_id:
         logger.info(f"Обнаружено сообщение из медиа-группы: {message.media_group_id}")
         
-        # Если это первое сообщение группы, создаем запись
-        if message.media_group_id not in media_groups:
-            media_groups[message.media_group_id] = {
-                'media': [],
+        media_group_aggregator.add(
+            message.media_group_id,
+            {
+                'chat_id': message.chat.id,
+                'media_group_id': message.media_group_id,
                 'text': text,
+                'entities': entities,
                 'title': title,
                 'message_id': message.message_id,
-                'channel_username': channel_username,
-                'timestamp': time.time()
-            }
-        else:
-            # Обновляем timestamp (время последнего обновления группы)
-            media_groups[message.media_group_id]['timestamp'] = time.time()
-            
-            # Если текст отсутствует в первом сообщении, но есть в текущем
-            if not media_groups[message.media_group_id]['text'] and text:
-                media_groups[message.media_group_id]['text'] = text
-                media_groups[message.media_group_id]['title'] = title
-        
-        # Добавляем медиа в группу
-        if message.photo:
-            photo = message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
-            media_groups[message.media_group_id]['media'].append({
-                'type': 'photo',
-                'url': file.file_path
-            })
-            logger.info(f"Добавлено фото в медиа-группу {message.media_group_id}")
-        elif message.video:
-            file = await context.bot.get_file(message.video.file_id)
-            media_groups[message.media_group_id]['media'].append({
-                'type': 'video',
-                'url': file.file_path
-            })
-            logger.info(f"Добавлено видео в медиа-группу {message.media_group_id}")
-        
-        # Отменяем предыдущий таймер для этой группы, если он существует
-        if message.media_group_id in media_group_timers:
-            timer = media_group_timers[message.media_group_id]
-            timer.cancel()
-        
-        # Создаем новый таймер для отложенной обработки группы
-        timer = threading.Timer(
-            5.0,  # Ждем 5 секунд после последнего сообщения
-            delayed_media_group_processing,
-            args=[context.bot, message.media_group_id]
+                'channel_username': channel_username
+            },
+            item
         )
-        timer.daemon = True  # Чтобы таймер не блокировал завершение программы
-        timer.start()
-        
-        # Сохраняем таймер
-        media_group_timers[message.media_group_id] = timer
-        
         return
     
-    # Если сообщение не является частью медиа-группы, обрабатываем его сразу
-    # Создание контента с текстом и ссылкой на Telegram
-    html_content = """
-    <div class="telegram-post">
-        {0}
-        <br><br>
-        <a href="https://t.me/{1}/{2}" class="telegram-link">Перейти в Telegram</a>
-    </div>
-    """.format(text.replace('\n', '<br>') if text else "", channel_username, message.message_id)
+    # Если сообщение не является частью медиа-группы, сразу ставим его в очередь публикации
+    media = [item] if item else []
     
-    # Обработка различных типов медиа
-    featured_media_id = None
+    payload = {
+        'chat_id': message.chat.id,
+        'message_id': message.message_id,
+        'media_group_id': None,
+        'title': title,
+        'text': text,
+        'entities': entities,
+        'channel_username': channel_username,
+        'media': media
+    }
     
     try:
-        # Обработка фотографий
-        if message.photo:
-            # Берем фото максимального размера
-            photo = message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
-            image_url = file.file_path
-            
-            # Загрузка изображения в WordPress
-            featured_media_id = await upload_media_to_wordpress(image_url, "image/jpeg")
-            
-            # Если изображение успешно загружено, добавляем его в контент
-            if featured_media_id:
-                media_info = get_media_info(featured_media_id)
-                if media_info and 'source_url' in media_info:
-                    img_html = f'<div class="wp-block-image"><figure><img src="{media_info["source_url"]}" alt=""/></figure></div>'
-                    html_content = img_html + html_content
-        
-        # Обработка видео
-        elif message.video:
-            file = await context.bot.get_file(message.video.file_id)
-            video_url = file.file_path
-            
-            # Загрузка видео в WordPress
-            media_id = await upload_media_to_wordpress(video_url, "video/mp4")
-            if media_id:
-                featured_media_id = media_id
-                
-                # Получаем информацию о загруженном видео
-                media_info = get_media_info(media_id)
-                if media_info and 'source_url' in media_info:
-                    # Добавляем видео в контент
-                    video_html = f'<div class="wp-block-video"><video controls src="{media_info["source_url"]}"></video></div>'
-                    html_content = video_html + html_content
-    
-        # Публикация в WordPress
-        success, post_url = await post_to_wordpress(title, html_content, featured_media_id)
-        
-        # Отправка сообщения администратору о результате
-        if success:
-            await send_admin_message(
-                context.bot,
-                f"✅ Новый пост с канала успешно опубликован на сайте!\nЗаголовок: {title}\nСсылка: {post_url}"
-            )
-        else:
-            await send_admin_message(
-                context.bot,
-                f"❌ Не удалось опубликовать пост с канала на сайт.\nЗаголовок: {title}"
-            )
+        enqueue_publication(payload)
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения канала: {e}")
-        await send_admin_message(
-            context.bot,
-            f"❌ Ошибка при обработке сообщения канала: {e}"
+        notify_admin(f"❌ Ошибка при обработке сообщения канала: {e}", 'error', urgent=True)
+
+# Применение правки сообщения к данным публикации
+def apply_message_edit(payload, edit):
+    if not payload['media_group_id']:
+        payload['text'] = edit['text']
+        payload['entities'] = edit['entities']
+        payload['title'] = edit['title']
+        if edit['item']:
+            payload['media'] = [edit['item']]
+        return
+    
+    # Подпись альбома хранится в одном из его сообщений, поэтому правка
+    # без текста подпись не меняет. Опоздавшее сообщение альбома добавляется в него
+    if edit['text']:
+        payload['text'] = edit['text']
+        payload['entities'] = edit['entities']
+        payload['title'] = edit['title']
+    if edit['item']:
+        payload['media'] = [
+            item for item in payload['media'] if item.get('message_id') != edit['message_id']
+        ] + [edit['item']]
+        payload['media'].sort(key=lambda item: item['message_id'])
+
+# Перенос правки сообщения в публикацию на сайт маршрута. base_key - ключ публикации без префикса сайта
+def queue_message_edit(route, base_key, edit):
+    target = route.target
+    post_key = target.job_key(base_key)
+    
+    # Публикация еще ждет в очереди: достаточно поменять ее данные
+    job = outbox.get(post_key)
+    if job is not None and job['status'] == 'pending':
+        apply_message_edit(job['payload'], edit)
+        job['payload']['categories'], job['payload']['tags'] = route.taxonomy(
+            job['payload']['text'], job['payload'].get('entities')
         )
+        if outbox.update_payload(post_key, job['payload']):
+            logger.info(f"Правка сообщения {edit['message_id']} учтена в задаче {post_key}")
+            return
+    
+    if job is None and target.post_map.get(post_key) is None:
+        logger.info(f"Сообщение {edit['message_id']} не публиковалось ботом на {target.name}, правка пропущена")
+        return
+    
+    outbox.enqueue(
+        f"{post_key}:edit:{edit['message_id']}:{edit['edit_date']:.0f}",
+        {'kind': 'edit', 'target': target.name, 'post_key': post_key, 'edit': edit}
+    )
+
+# Обработчик исправленных сообщений в канале
+async def edited_channel_post(update: Update, context: CallbackContext):
+    message = update.edited_channel_post
+    
+    if str(message.chat.id) not in channel_routes:
+        return
+    
+    text, entities, title, channel_username, item = parse_channel_message(message)
+    edit = {
+        'message_id': message.message_id,
+        'edit_date': message.edit_date.timestamp() if message.edit_date else time.time(),
+        'text': text,
+        'entities': entities,
+        'title': title,
+        'item': item
+    }
+    base_key = publish_job_key({
+        'chat_id': message.chat.id,
+        'message_id': message.message_id,
+        'media_group_id': message.media_group_id
+    })
+    
+    try:
+        # Альбом еще собирается: правим его на месте
+        if message.media_group_id and message.media_group_id in media_group_aggregator.groups:
+            apply_message_edit(media_group_aggregator.groups[message.media_group_id], edit)
+            logger.info(f"Правка сообщения {message.message_id} учтена в собираемой медиа-группе")
+            return
+        
+        for route in channel_routes[str(message.chat.id)]:
+            queue_message_edit(route, base_key, edit)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке правки сообщения канала: {e}")
+        notify_admin(f"❌ Ошибка при обработке правки сообщения канала: {e}", 'error')
 
 # Обработчик ошибок
 async def error_handler(update: Update, context: CallbackContext):
     logger.error(f"Произошла ошибка: {context.error}")
     
-    # Отправка сообщения администратору об ошибке
+    # Сообщение администратору об ошибке; одинаковые ошибки объединяются в сводке
+    notify_admin(
+        f"❌ Произошла ошибка в работе бота:\n{str(context.error)}",
+        'error',
+        f"{type(context.error).__name__}: {context.error}"
+    )
+
+# Запись файла состояния: сначала во временный файл, затем замена, чтобы файл не оказался недописанным
+def write_json_atomic(path, data):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(temporary_path, path)
+
+# Чтение снимка медиа-групп, сохраненного при прошлой остановке. Файл удаляется, когда
+# восстановленные группы поставлены в очередь, или перезаписывается при следующей остановке
+def load_media_group_snapshot():
+    try:
+        with open(MEDIA_GROUP_SNAPSHOT_PATH, encoding='utf-8') as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать снимок медиа-групп {MEDIA_GROUP_SNAPSHOT_PATH}: {e}")
+        return None
+    
+    return snapshot
+
+def remove_media_group_snapshot():
     try:
-        await send_admin_message(
-            context.bot, 
-            f"❌ Произошла ошибка в работе бота:\n{str(context.error)}"
+        os.remove(MEDIA_GROUP_SNAPSHOT_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Не удалось удалить снимок медиа-групп {MEDIA_GROUP_SNAPSHOT_PATH}: {e}")
+
+# Прогрев сайта: соединения пула открываются заранее, учетные данные проверяются до первой публикации
+async def warm_up_target(target):
+    connections = min(target.workers, target.client.limits.max_keepalive_connections)
+    with metrics.track_stage("wp_warm_up"):
+        ready = await target.client.warm_up(connections)
+    
+    prefix = f"{target.name}: " if len(targets) > 1 else ""
+    if ready:
+        logger.info(f"{prefix}Соединения с WordPress открыты заранее: {connections}")
+    else:
+        notify_admin(
+            f"❌ {prefix}При запуске бота WordPress недоступен или отклонил учетные данные. "
+            f"Публикации будут повторяться, пока сайт не станет доступен.",
+            'error',
+            urgent=True
         )
-    except Exception as e:
-        logger.error(f"Не удалось отправить сообщение об ошибке: {e}")
+
+# Запуск: уведомления, сборщик медиа-групп с группами, сохраненными при прошлой остановке,
+# прогрев соединений с сайтами и обработчики очереди публикаций (незавершенные задачи продолжаются)
+async def on_startup(application):
+    global media_group_aggregator, metrics_server, admin_notifier
+    
+    admin_notifier = AdminNotifier(
+        functools.partial(send_admin_message, application.bot),
+        window=ADMIN_NOTIFY_WINDOW,
+        rate=ADMIN_NOTIFY_RATE,
+        burst=ADMIN_NOTIFY_BURST,
+        max_items=ADMIN_NOTIFY_MAX_ITEMS
+    )
+    media_group_aggregator = MediaGroupAggregator(
+        functools.partial(process_media_group, application.bot),
+        quiet_window=MEDIA_GROUP_WINDOW,
+        max_items=MEDIA_GROUP_MAX_ITEMS,
+        max_pending=MEDIA_GROUP_MAX_PENDING,
+        ttl=MEDIA_GROUP_TTL
+    )
+    
+    metrics.PENDING_MEDIA_GROUPS.function = media_group_aggregator.pending_count
+    metrics.OUTBOX_PENDING.function = outbox.pending_count
+    metrics.ADMIN_NOTIFICATIONS_PENDING.function = admin_notifier.pending_count
+    metrics.WP_CONCURRENCY_LIMIT.function = lambda: {
+        name: int(target.guard.limiter.limit) for name, target in targets.items()
+    }
+    metrics.WP_CIRCUIT_OPEN.function = lambda: {
+        name: int(target.guard.breaker.state != CircuitBreaker.CLOSED) for name, target in targets.items()
+    }
+    if METRICS_PORT:
+        metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    
+    snapshot = load_media_group_snapshot()
+    if snapshot:
+        restored = media_group_aggregator.restore(snapshot)
+        restored_media_groups.update(snapshot['groups'])
+        logger.info(f"Восстановлено незавершенных медиа-групп: {restored}")
+    
+    # Сайты прогреваются параллельно; недоступный сайт не задерживает запуск дольше WARMUP_TIMEOUT
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(warm_up_target(target) for target in targets.values())),
+            timeout=WARMUP_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Прогрев соединений с WordPress не завершился за {WARMUP_TIMEOUT:.0f} сек")
+    
+    # Задачи, поставленные до настройки нескольких сайтов, выполняет только сайт с пустым префиксом
+    if not any(not target.key_prefix for target in targets.values()):
+        orphaned = outbox.pending_count(
+            exclude=[target.key_prefix for target in targets.values()] + [BACKFILL_KEY_PREFIX]
+        )
+        if orphaned:
+            logger.warning(f"В очереди задач без сайта: {orphaned}")
+            notify_admin(
+                f"⚠️ В очереди {orphaned} задач, поставленных до настройки нескольких сайтов. Они не будут "
+                f"выполнены, пока одному из сайтов в {TARGETS_CONFIG} не указан параметр default: true.",
+                'error',
+                urgent=True
+            )
+    
+    # У каждого сайта свои обработчики очереди, поэтому медленный сайт не задерживает остальные
+    for target in targets.values():
+        prefix, exclude = target_key_filter(target)
+        outbox_workers.extend(outbox.start_workers(
+            functools.partial(publish_job, application.bot, target),
+            on_dead=lambda job, error: publish_job_dead(application.bot, job, error),
+            concurrency=target.workers,
+            prefix=prefix,
+            exclude=exclude
+        ))
+
+# Остановка (в том числе по SIGTERM) не дольше SHUTDOWN_TIMEOUT: незавершенные медиа-группы
+# сохраняются на диск, начатые публикации завершаются, а не успевшие возвращаются в очередь
+# (загруженные медиа при повторе берутся из кэша), накопленные уведомления уходят администратору
+async def on_stop(application):
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    if metrics_server is not None:
+        metrics_server.close()
+    
+    if media_group_aggregator.pending_count():
+        try:
+            write_json_atomic(MEDIA_GROUP_SNAPSHOT_PATH, media_group_aggregator.snapshot())
+            logger.info(f"Сохранено незавершенных медиа-групп: {media_group_aggregator.pending_count()}")
+            media_group_aggregator.clear()
+        except (OSError, TypeError, ValueError) as e:
+            # Лучше опубликовать альбом не полностью, чем потерять его
+            logger.error(f"Не удалось сохранить медиа-группы, публикуем их досрочно: {e}")
+    else:
+        # Незавершенных групп нет, снимок прошлой остановки больше не нужен
+        remove_media_group_snapshot()
+    await media_group_aggregator.flush_all()
+    
+    await outbox.stop_workers(outbox_workers, timeout=max(0.0, deadline - time.monotonic()))
+    outbox_workers.clear()
+    
+    await admin_notifier.close(timeout=max(1.0, deadline - time.monotonic()))
+
+# Закрытие пулов соединений WordPress при остановке бота
+async def on_shutdown(application):
+    for target in targets.values():
+        await target.close()
+    outbox.close()
+
+# Запуск HTTP-сервера для приема обновлений от Telegram
+def run_webhook(application):
+    if not TELEGRAM_WEBHOOK_URL:
+        logger.error("TELEGRAM_WEBHOOK_URL не найден в .env файле, режим webhook недоступен")
+        return
+    
+    # Telegram передает секрет в заголовке X-Telegram-Bot-Api-Secret-Token,
+    # запросы без него отклоняются сервером
+    secret_token = WEBHOOK_SECRET_TOKEN
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET_TOKEN не задан, используется случайный секрет")
+    
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=secret_token
+    )
+
+# Файл контрольной точки импорта: до какого сообщения экспорт уже поставлен в очередь
+def load_backfill_checkpoint(path, export_dir):
+    try:
+        with open(path, encoding='utf-8') as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return {'export': export_dir, 'last_message_id': 0}
+    
+    if checkpoint.get('export') != export_dir:
+        logger.warning(f"Контрольная точка {path} относится к другому экспорту, начинаем сначала")
+        return {'export': export_dir, 'last_message_id': 0}
+    return checkpoint
+
+async def backfill_job_dead(job, error):
+    logger.error(f"Не удалось импортировать сообщение {job['payload']['message_id']}: {error}")
+
+# Импорт истории канала из экспорта Telegram Desktop через ту же очередь публикаций, что и новые посты.
+# Задачи ставятся в очередь партиями; после перезапуска импорт продолжается с контрольной точки,
+# а уже опубликованные сообщения пропускаются
+async def run_backfill(args):
+    export = telegram_export.load_export(args.export)
+    chat_id = telegram_export.export_chat_id(export)
+    routes = channel_routes.get(str(chat_id))
+    if not routes:
+        if len(targets) != 1:
+            logger.error(f"Канал {chat_id} из экспорта не указан в настройках, импортировать некуда")
+            return
+        logger.warning(f"Экспорт относится к каналу {chat_id}, а бот настроен на {CHANNEL_ID}")
+        routes = [Route(next(iter(targets.values())))]
+    
+    # Публикации по сообщениям экспорта: на каждый сайт канала своя задача
+    checkpoint = load_backfill_checkpoint(args.checkpoint, export['base_dir'])
+    posts = []
+    skipped = 0
+    for post in telegram_export.export_posts(export):
+        if post['message_id'] <= checkpoint['last_message_id']:
+            skipped += 1
+            continue
+        
+        payload = {
+            'chat_id': chat_id,
+            'message_id': post['message_id'],
+            'media_group_id': f"export-{post['message_id']}" if post['album'] else None,
+            'title': post_title(post['text']),
+            'text': post['text'],
+            'entities': post['entities'],
+            'channel_username': channel_link_path(chat_id, args.channel_username),
+            'media': post['media'],
+            'date': post['date'],
+            'source': 'backfill'
+        }
+        jobs = []
+        for route in routes:
+            target = route.target
+            # У задач импорта свой префикс: их выполняют только обработчики импорта, а обработчики
+            # бота, который может работать одновременно с импортом, их не берут
+            key = target.job_key(publish_job_key(payload))
+            if (target.post_map.find_by_message(chat_id, post['message_id'])
+                    or outbox.get(key) or outbox.get(BACKFILL_KEY_PREFIX + key)):
+                continue
+            key = BACKFILL_KEY_PREFIX + key
+            categories, tags = route.taxonomy(payload['text'], payload['entities'])
+            jobs.append((key, {**payload, 'target': target.name, 'categories': categories, 'tags': tags}))
+        if jobs:
+            posts.append((post['message_id'], jobs))
+        else:
+            skipped += 1
+    
+    all_jobs = [job for _, jobs in posts for job in jobs]
+    media_count = sum(len(job['media']) for _, job in all_jobs)
+    media_bytes = sum(os.path.getsize(item['path']) for _, job in all_jobs for item in job['media'])
+    logger.info(
+        f"К импорту {len(posts)} постов ({len(all_jobs)} публикаций), {media_count} файлов "
+        f"({media_bytes / 1024 / 1024:.1f} МБ), пропущено уже импортированных: {skipped}"
+    )
+    
+    try:
+        if args.dry_run:
+            # На пост уходит запрос на создание и по запросу на каждый файл; время ограничено
+            # либо частотой запросов к WordPress, либо скоростью передачи файлов. Сайты
+            # импортируются параллельно, поэтому оценка - по самому медленному
+            estimate = 0
+            requests_count = 0
+            for target in {route.target for route in routes}:
+                jobs = [job for _, job in all_jobs if job['target'] == target.name]
+                target_requests = len(jobs) + sum(len(job['media']) for job in jobs)
+                target_bytes = sum(os.path.getsize(item['path']) for job in jobs for item in job['media'])
+                requests_count += target_requests
+                estimate = max(
+                    estimate,
+                    target_requests / target.guard.bucket.rate,
+                    target_bytes / (args.bandwidth * 1024 * 1024)
+                )
+            logger.info(f"Оценка времени импорта: {estimate / 60:.1f} мин ({requests_count} запросов к WordPress)")
+            return
+        
+        started = time.perf_counter()
+        workers = []
+        for target in {route.target for route in routes}:
+            prefix, exclude = target_key_filter(target, backfill=True)
+            workers.extend(outbox.start_workers(
+                functools.partial(publish_job, None, target),
+                on_dead=backfill_job_dead,
+                concurrency=args.workers or target.workers,
+                prefix=prefix,
+                exclude=exclude
+            ))
+        try:
+            for start in range(0, len(posts), args.batch_size):
+                batch = posts[start:start + args.batch_size]
+                for _, jobs in batch:
+                    for key, job in jobs:
+                        outbox.enqueue(key, job)
+                checkpoint['last_message_id'] = batch[-1][0]
+                write_json_atomic(args.checkpoint, checkpoint)
+                
+                # Следующая партия ставится, когда очередь почти разобрана
+                while outbox.pending_count(BACKFILL_KEY_PREFIX) > args.batch_size:
+                    await asyncio.sleep(0.5)
+                logger.info(f"Поставлено в очередь {start + len(batch)} из {len(posts)} постов")
+            
+            while outbox.pending_count(BACKFILL_KEY_PREFIX):
+                await asyncio.sleep(0.5)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        for target in targets.values():
+            await target.close()
+    
+    elapsed = time.perf_counter() - started
+    dead = sum(1 for key, _ in all_jobs if outbox.get(key)['status'] == 'dead')
+    logger.info(
+        f"Импорт завершен: опубликовано {len(all_jobs) - dead}, с ошибками {dead}, "
+        f"{elapsed:.0f} сек ({len(all_jobs) / elapsed * 60 if elapsed else 0:.0f} публикаций в минуту)"
+    )
 
 def main():
+    parser = argparse.ArgumentParser(description="Публикация постов из Telegram канала в WordPress")
+    parser.add_argument(
+        '--webhook',
+        action='store_true',
+        default=os.getenv('BOT_MODE') == 'webhook',
+        help="принимать обновления через webhook вместо long polling (или BOT_MODE=webhook)"
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    backfill = subparsers.add_parser('backfill', help="импорт истории канала из экспорта Telegram Desktop")
+    backfill.add_argument('export', help="папка экспорта (с result.json) или путь к result.json")
+    backfill.add_argument('--channel-username', help="username канала для ссылок на сообщения (для канала без username не нужен)")
+    backfill.add_argument('--workers', type=int, help="число одновременных публикаций на каждый сайт")
+    backfill.add_argument('--batch-size', type=int, default=100, help="сколько постов ставить в очередь за раз")
+    backfill.add_argument('--checkpoint', default='backfill_checkpoint.json', help="файл контрольной точки")
+    backfill.add_argument('--dry-run', action='store_true', help="только посчитать посты и оценить время")
+    backfill.add_argument('--bandwidth', type=float, default=10,
+                          help="скорость передачи файлов в WordPress для оценки времени, МБ/с")
+    args = parser.parse_args()
+    
+    if args.command == 'backfill':
+        try:
+            asyncio.run(run_backfill(args))
+        finally:
+            outbox.close()
+        return
+    
     # Создание приложения
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Регистрация обработчиков
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("unpublish", unpublish))
+    application.add_handler(CommandHandler("dead", dead))
+    application.add_handler(CommandHandler("retry", retry))
     
-    # Обработчик для новых сообщений в канале
-    application.add_handler(MessageHandler(filters.ChatType.CHANNEL, channel_post))
+    # Обработчики для новых и исправленных сообщений в канале
+    application.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, channel_post))
+    application.add_handler(MessageHandler(filters.UpdateType.EDITED_CHANNEL_POST, edited_channel_post))
     
     # Регистрация обработчика ошибок
     application.add_error_handler(error_handler)
@@ -439,18 +1164,25 @@ def main():
     # Проверка переменных окружения
     if not BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN не найден в .env файле")
-    if not CHANNEL_ID:
-        logger.error("TELEGRAM_CHANNEL_ID не найден в .env файле")
     if not ADMIN_USER_ID:
         logger.error("ADMIN_USER_ID не найден в .env файле")
-    if not WP_URL:
-        logger.error("WP_URL не найден в .env файле")
-    if not WP_USERNAME:
-        logger.error("WP_USERNAME не найден в .env файле")
-    if not WP_PASSWORD:
-        logger.error("WP_PASSWORD не найден в .env файле")
-    
-    application.run_polling()
+    # Каналы и сайты задаются либо файлом настроек, либо переменными окружения
+    if TARGETS_CONFIG:
+        logger.info(f"Каналов: {len(channel_routes)}, сайтов: {len(targets)} (из {TARGETS_CONFIG})")
+    else:
+        if not CHANNEL_ID:
+            logger.error("TELEGRAM_CHANNEL_ID не найден в .env файле")
+        if not WP_URL:
+            logger.error("WP_URL не найден в .env файле")
+        if not WP_USERNAME:
+            logger.error("WP_USERNAME не найден в .env файле")
+        if not WP_PASSWORD:
+            logger.error("WP_PASSWORD не найден в .env файле")
+    
+    if args.webhook:
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""Замер времени загрузки альбома в локальный фейковый WordPress.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.album_latency
+
+Та же проверка (падает, если время на элемент приближается к прежней паузе)
+выполняется тестом tests/test_album_latency.py.
+
+Раньше каждая загрузка ждала фиксированные 2 секунды, и альбом из 10 элементов
+занимал не меньше 20 секунд. Теперь время на элемент определяется только
+задержкой сервера и временем, через которое WordPress сообщает о готовности медиа.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_servers import FakeTelegramFiles, FakeWordPress
+from wp_client import WordPressClient
+
+# Прежняя фиксированная пауза после каждой загрузки и допустимое время на элемент
+OLD_FIXED_SLEEP = 2.0
+MAX_SECONDS_PER_ITEM = 1.0
+
+
+async def upload_album(client, files, size):
+    started = time.perf_counter()
+    for _ in range(size):
+        media = await client.upload_media(files.file_url(100 * 1024), "image/jpeg")
+        assert media, "загрузка не удалась"
+    return time.perf_counter() - started
+
+
+# Возвращает время на элемент для каждого размера альбома
+async def run(sizes, ready_after, latency):
+    wordpress = FakeWordPress(latency=latency, ready_after=ready_after).start()
+    files = FakeTelegramFiles(latency=latency).start()
+    client = WordPressClient(wordpress.url, "user", "password")
+    per_item = {}
+    try:
+        for size in sizes:
+            elapsed = await upload_album(client, files, size)
+            per_item[size] = elapsed / size
+            print(f"{size:>3} элементов: {elapsed:6.2f} сек, {elapsed / size:5.2f} сек на элемент")
+    finally:
+        await client.close()
+        wordpress.stop()
+        files.stop()
+    return per_item
+
+
+def check(per_item):
+    for size, seconds in per_item.items():
+        assert seconds < MAX_SECONDS_PER_ITEM, (
+            f"альбом из {size} элементов: {seconds:.2f} сек на элемент, "
+            f"время снова растет почти на {OLD_FIXED_SLEEP:.0f} сек за элемент"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--ready-after', type=float, default=0.3,
+                        help="через сколько секунд фейковый WordPress отдает размеры изображения")
+    parser.add_argument('--latency', type=float, default=0.01, help="задержка ответа серверов, сек")
+    args = parser.parse_args()
+    check(asyncio.run(run(args.sizes, args.ready_after, args.latency)))
+
+
+if __name__ == "__main__":
+    main()
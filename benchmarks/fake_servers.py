@@ -0,0 +1,258 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # Тело читается по частям и отбрасывается, чтобы сервер не занимал память,
+    # keep=True сохраняет тело целиком (для небольших JSON-запросов)
+    def _read_body(self, keep=False):
+        size = 0
+        kept = []
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    return b''.join(kept) if keep else size
+                remaining = chunk_size
+                while remaining:
+                    data = self.rfile.read(min(remaining, 65536))
+                    remaining -= len(data)
+                    if keep:
+                        kept.append(data)
+                size += chunk_size
+                self.rfile.readline()
+
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining:
+            data = self.rfile.read(min(remaining, 65536))
+            if not data:
+                break
+            remaining -= len(data)
+            size += len(data)
+            if keep:
+                kept.append(data)
+        return b''.join(kept) if keep else size
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeWordPress:
+    """Локальный сервер, имитирующий WordPress REST API.
+
+    latency - задержка каждого ответа, failure_rate - доля запросов на создание
+    медиа и постов, на которые сервер отвечает 503.
+    """
+
+    def __init__(self, latency=0.0, ready_after=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        # Через сколько секунд после загрузки медиа считается обработанным
+        self.ready_after = ready_after
+        self.failure_rate = failure_rate
+        self.failures = 0
+        self._random = random.Random(seed)
+        self.requests = Counter()
+        self.media = {}
+        self.posts = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _media_json(self, media_id):
+        media = self.media[media_id]
+        ready = time.monotonic() - media['created'] >= self.ready_after
+        media_type = 'image' if media['mime_type'].startswith('image/') else 'file'
+        return {
+            'id': media_id,
+            'source_url': f"{self.url}/wp-content/uploads/{media_id}",
+            'mime_type': media['mime_type'],
+            'media_type': media_type,
+            'media_details': {'width': 1280, 'height': 720, 'sizes': {}} if ready and media_type == 'image' else {}
+        }
+
+    def _should_fail(self):
+        with self._lock:
+            if self._random.random() < self.failure_rate:
+                self.failures += 1
+                return True
+            return False
+
+    def _post_json(self, post_id):
+        post = self.posts[post_id]
+        return {
+            'id': post_id,
+            'link': f"{self.url}/?p={post_id}",
+            'title': {'rendered': post.get('title', '')},
+            'content': {'rendered': post.get('content', '')},
+            'featured_media': post.get('featured_media', 0),
+            'status': post.get('status', 'publish')
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(_FakeHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                fake.requests[('GET', re.sub(r'/\d+$', '/<id>', url.path))] += 1
+                time.sleep(fake.latency)
+                match = re.fullmatch(r'/wp-json/wp/v2/media/(\d+)', url.path)
+                if url.path == '/wp-json':
+                    self._send_json(200, {'name': 'fake'})
+                elif url.path == '/wp-json/wp/v2/users/me':
+                    self._send_json(200, {'id': 1, 'name': 'fake'})
+                elif url.path == '/wp-json/wp/v2/posts':
+                    search = parse_qs(url.query).get('search', [''])[0]
+                    with fake._lock:
+                        found = [fake._post_json(post_id) for post_id, post in fake.posts.items()
+                                 if search in post['content']]
+                    self._send_json(200, found)
+                elif match and int(match.group(1)) in fake.media:
+                    self._send_json(200, fake._media_json(int(match.group(1))))
+                else:
+                    self._send_json(404, {'code': 'rest_no_route'})
+
+            def do_POST(self):
+                fake.requests[('POST', re.sub(r'/\d+$', '/<id>', self.path))] += 1
+                is_media = self.path == '/wp-json/wp/v2/media'
+                post_match = re.fullmatch(r'/wp-json/wp/v2/posts/(\d+)', self.path)
+                body = self._read_body(keep=not is_media)
+                time.sleep(fake.latency)
+                if self.path in ('/wp-json/wp/v2/media', '/wp-json/wp/v2/posts') and fake._should_fail():
+                    self._send_json(503, {'code': 'service_unavailable'})
+                elif is_media:
+                    size = body
+                    with fake._lock:
+                        media_id = len(fake.media) + 1
+                        fake.media[media_id] = {
+                            'mime_type': self.headers.get('Content-Type', 'application/octet-stream'),
+                            'size': size,
+                            'created': time.monotonic()
+                        }
+                    self._send_json(201, fake._media_json(media_id))
+                elif self.path == '/wp-json/wp/v2/posts':
+                    with fake._lock:
+                        post_id = len(fake.posts) + 1
+                        fake.posts[post_id] = json.loads(body or b'{}')
+                        post = fake._post_json(post_id)
+                    self._send_json(201, post)
+                elif post_match and int(post_match.group(1)) in fake.posts:
+                    # Обновление поста: меняются только переданные поля
+                    with fake._lock:
+                        post_id = int(post_match.group(1))
+                        fake.posts[post_id].update(json.loads(body or b'{}'))
+                        post = fake._post_json(post_id)
+                    self._send_json(200, post)
+                else:
+                    self._send_json(404, {'code': 'rest_no_route'})
+
+            def do_DELETE(self):
+                fake.requests[('DELETE', re.sub(r'/\d+$', '/<id>', self.path))] += 1
+                time.sleep(fake.latency)
+                match = re.fullmatch(r'/wp-json/wp/v2/posts/(\d+)', self.path)
+                if match and int(match.group(1)) in fake.posts:
+                    # Без force=true пост перемещается в корзину
+                    with fake._lock:
+                        post_id = int(match.group(1))
+                        fake.posts[post_id]['status'] = 'trash'
+                        post = fake._post_json(post_id)
+                    self._send_json(200, post)
+                else:
+                    self._send_json(404, {'code': 'rest_no_route'})
+
+        return Handler
+
+
+class FakeTelegramFiles:
+    """Локальный сервер, имитирующий файловый API Telegram.
+
+    Метод /bot<токен>/getFile?file_id=<размер в байтах> возвращает путь к файлу,
+    сам файл отдается по адресу /file/<размер в байтах>.
+    """
+
+    def __init__(self, latency=0.0, chunk_size=65536):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.requests = Counter()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def file_url(self, size):
+        return f"{self.url}/file/{size}"
+
+    def get_file_url(self, token, file_id):
+        return f"{self.url}/bot{token}/getFile?file_id={file_id}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(_FakeHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                time.sleep(fake.latency)
+                if re.fullmatch(r'/bot[^/]+/getFile', url.path):
+                    fake.requests['getFile'] += 1
+                    file_id = parse_qs(url.query).get('file_id', [''])[0]
+                    self._send_json(200, {'ok': True, 'result': {'file_id': file_id, 'file_path': fake.file_url(file_id)}})
+                    return
+
+                fake.requests['GET /file'] += 1
+                match = re.fullmatch(r'/file/(\d+)', url.path)
+                if not match:
+                    self._send_json(404, {'ok': False})
+                    return
+
+                remaining = int(match.group(1))
+                chunk = b'\0' * fake.chunk_size
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(remaining))
+                self.end_headers()
+                while remaining:
+                    self.wfile.write(chunk[:remaining])
+                    remaining -= min(remaining, fake.chunk_size)
+
+        return Handler
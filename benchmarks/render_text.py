@@ -0,0 +1,83 @@
+"""Замер скорости сборки разметки поста из текста с сущностями Telegram.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.render_text --length 4096 --density 0.3
+
+Генерируется длинный текст с кириллицей и эмодзи (смещения сущностей считаются
+в UTF-16) и плотной разметкой: жирный, курсив, ссылки, код, вложенные сущности.
+Время рендера должно расти линейно с длиной текста.
+"""
+import argparse
+import random
+import time
+
+from renderer import render_post, render_text
+from wp_client import MediaRecord
+
+WORDS = ["канал", "новость", "WordPress", "😀", "пост", "<тег>", "a&b", "текст", "🚀🚀", "ссылка"]
+SIMPLE_TYPES = ["bold", "italic", "underline", "strikethrough", "spoiler", "code"]
+
+
+def utf16_length(value):
+    return len(value.encode('utf-16-le')) // 2
+
+
+# Текст примерно из length символов и сущности, покрывающие долю density слов
+def build_post(length, density, seed=0):
+    rng = random.Random(seed)
+    words = []
+    entities = []
+    offset = 0
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        separator = "\n\n" if rng.random() < 0.05 else ("\n" if rng.random() < 0.1 else " ")
+        if rng.random() < density:
+            kind = rng.choice(SIMPLE_TYPES + ["text_link"])
+            entity = {'type': kind, 'offset': offset, 'length': utf16_length(word)}
+            if kind == 'text_link':
+                entity['url'] = f"https://example.com/{len(entities)}?a=1&b=2"
+            entities.append(entity)
+            # Часть сущностей вложена: курсив внутри жирного
+            if kind == 'bold' and rng.random() < 0.5:
+                entities.append({'type': 'italic', 'offset': offset, 'length': utf16_length(word)})
+        words.append(word + separator)
+        offset += utf16_length(word + separator)
+        size += len(word + separator)
+
+    text = "".join(words)
+    # Блок кода в конце поста
+    code = "print('код')\nreturn x < y"
+    entities.append({'type': 'pre', 'offset': utf16_length(text), 'length': utf16_length(code)})
+    return text + code, entities
+
+
+def measure(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1024, 4096, 16384, 65536],
+                        help="длины текстов в символах (подпись в Telegram до 1024, сообщение до 4096)")
+    parser.add_argument('--density', type=float, default=0.3, help="доля слов с форматированием")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    media = [('photo', MediaRecord(index, f"https://example.com/wp-content/uploads/{index}.jpg")) for index in range(10)]
+    for length in args.lengths:
+        text, entities = build_post(length, args.density)
+        repeat = max(1, args.repeat * 1024 // length)
+        text_seconds = measure(lambda: render_text(text, entities), repeat)
+        post_seconds = measure(lambda: render_post(text, entities, "channel", 1, media, gallery=True), repeat)
+        print(f"{len(text):>6} символов, {len(entities):>5} сущностей: "
+              f"текст {text_seconds * 1000:7.3f} мс, пост с галереей {post_seconds * 1000:7.3f} мс, "
+              f"{len(text) / text_seconds / 1e6:5.2f} млн символов/с")
+
+
+if __name__ == "__main__":
+    main()
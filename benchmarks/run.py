@@ -0,0 +1,225 @@
+"""Нагрузочный прогон бота на локальных фейковых серверах Telegram и WordPress.
+
+Синтетический поток сообщений канала проходит через channel_post, сборщик
+медиа-групп и очередь публикаций точно так же, как в работающем боте.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.run --scenario album --posts 20 --output results/album.json
+    python -m benchmarks.run --scenario mixed --posts 40 --wp-latency 0.05 --wp-failure-rate 0.1
+
+Результат (пропускная способность, p50/p99 задержки публикации, пиковый RSS,
+число запросов к WordPress и Telegram) печатается и сохраняется в JSON,
+чтобы прогоны можно было сравнивать между собой.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timezone
+
+import httpx
+from telegram import Chat, Message, PhotoSize, Update, Video
+
+from benchmarks.fake_servers import FakeTelegramFiles, FakeWordPress
+
+BOT_TOKEN = "123456:benchmark"
+CHANNEL_ID = -1001234567890
+SCENARIOS = ('text', 'photo', 'album', 'video')
+
+
+class FakeBot:
+    """Минимальная замена telegram.Bot: getFile идет в фейковый сервер, сообщения считаются"""
+
+    def __init__(self, files):
+        self.files = files
+        self.sent = []
+        self._client = httpx.AsyncClient()
+
+    async def get_file(self, file_id):
+        response = await self._client.get(self.files.get_file_url(BOT_TOKEN, file_id))
+        return types.SimpleNamespace(**response.json()['result'])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def peak_rss_mb():
+    # В Linux ru_maxrss возвращается в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Синтетический поток: список постов, каждый пост - список сообщений канала
+def build_stream(args):
+    chat = Chat(CHANNEL_ID, Chat.CHANNEL, title="Benchmark", username="benchmark")
+    date = datetime.now(timezone.utc)
+    photo_size = args.photo_kb * 1024
+    video_size = args.video_mb * 1024 * 1024
+    scenarios = SCENARIOS if args.scenario == 'mixed' else (args.scenario,)
+    message_id = 0
+    stream = []
+
+    def photo(unique_id):
+        return (PhotoSize(str(photo_size), unique_id, 1280, 720),)
+
+    for index in range(args.posts):
+        scenario = scenarios[index % len(scenarios)]
+        text = f"Пост {index}\nТестовый текст для прогона."
+        messages = []
+        if scenario == 'text':
+            message_id += 1
+            messages.append(Message(message_id, date, chat, text=text))
+        elif scenario == 'photo':
+            message_id += 1
+            messages.append(Message(message_id, date, chat, caption=text, photo=photo(f"photo-{message_id}")))
+        elif scenario == 'video':
+            message_id += 1
+            video = Video(str(video_size), f"video-{message_id}", 1280, 720, 10)
+            messages.append(Message(message_id, date, chat, caption=text, video=video))
+        else:
+            group_id = f"album-{index}"
+            for position in range(args.album_size):
+                message_id += 1
+                messages.append(Message(
+                    message_id, date, chat,
+                    caption=text if position == 0 else None,
+                    photo=photo(f"photo-{message_id}"),
+                    media_group_id=group_id
+                ))
+        stream.append(messages)
+
+    return stream
+
+
+async def replay(bot_module, args, wordpress, files):
+    bot = FakeBot(files)
+    application = types.SimpleNamespace(bot=bot)
+    context = types.SimpleNamespace(bot=bot)
+    stream = build_stream(args)
+
+    await bot_module.on_startup(application)
+    started_at = {}
+    update_id = 0
+    wall_started = time.time()
+    try:
+        for messages in stream:
+            first = messages[0]
+            key = (f"{CHANNEL_ID}:group:{first.media_group_id}" if first.media_group_id
+                   else f"{CHANNEL_ID}:{first.message_id}")
+            started_at[key] = time.time()
+            for message in messages:
+                update_id += 1
+                await bot_module.channel_post(Update(update_id, channel_post=message), context)
+            if args.interval:
+                await asyncio.sleep(args.interval)
+
+        # Ждем, пока все задачи будут опубликованы или исчерпают попытки
+        while True:
+            rows = bot_module.outbox._db.execute(
+                "SELECT key, status, updated_at FROM outbox WHERE status IN ('done', 'dead')"
+            ).fetchall()
+            if len(rows) >= len(started_at):
+                break
+            await asyncio.sleep(0.05)
+        wall_seconds = time.time() - wall_started
+        stages = bot_module.metrics.summary().splitlines()
+    finally:
+        await bot_module.on_stop(application)
+        await bot_module.on_shutdown(application)
+        await bot.close()
+
+    latencies = [updated_at - started_at[key] for key, status, updated_at in rows if status == 'done']
+    published = len(latencies)
+    return {
+        'posts': len(stream),
+        'messages': update_id,
+        'published': published,
+        'dead': len(rows) - published,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_posts_per_sec': round(published / wall_seconds, 2) if wall_seconds else None,
+        'latency_p50_sec': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'latency_p99_sec': round(percentile(latencies, 0.99), 3) if latencies else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'wordpress_requests': {f"{method} {path}": count for (method, path), count in sorted(wordpress.requests.items())},
+        'wordpress_injected_failures': wordpress.failures,
+        'telegram_requests': dict(files.requests),
+        'admin_messages': len(bot.sent),
+        'stages': stages
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=SCENARIOS + ('mixed',), default='mixed')
+    parser.add_argument('--posts', type=int, default=20, help="число постов в потоке")
+    parser.add_argument('--album-size', type=int, default=10)
+    parser.add_argument('--photo-kb', type=int, default=200)
+    parser.add_argument('--video-mb', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.0, help="пауза между постами, сек")
+    parser.add_argument('--wp-latency', type=float, default=0.02, help="задержка ответа WordPress, сек")
+    parser.add_argument('--tg-latency', type=float, default=0.01, help="задержка ответа Telegram, сек")
+    parser.add_argument('--wp-failure-rate', type=float, default=0.0, help="доля ответов 503 на создание медиа и постов")
+    parser.add_argument('--album-window', type=float, default=0.5, help="MEDIA_GROUP_WINDOW для прогона, сек")
+    parser.add_argument('--output', help="куда сохранить результат в JSON")
+    args = parser.parse_args()
+
+    wordpress = FakeWordPress(latency=args.wp_latency, failure_rate=args.wp_failure_rate).start()
+    files = FakeTelegramFiles(latency=args.tg_latency).start()
+    state_dir = tempfile.TemporaryDirectory()
+
+    # Настройки бота читаются при импорте модуля, поэтому окружение задается заранее
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_CHANNEL_ID': str(CHANNEL_ID),
+        'ADMIN_USER_ID': '1',
+        'WP_URL': wordpress.url,
+        'WP_USERNAME': 'benchmark',
+        'WP_PASSWORD': 'benchmark',
+        'STATE_DB_PATH': os.path.join(state_dir.name, 'state.sqlite3'),
+        'MEDIA_GROUP_WINDOW': str(args.album_window),
+        'OUTBOX_RETRY_DELAY': os.getenv('OUTBOX_RETRY_DELAY', '0.2'),
+        'METRICS_PORT': '0'
+    })
+    import automated_w_tg
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        results = asyncio.run(replay(automated_w_tg, args, wordpress, files))
+    finally:
+        wordpress.stop()
+        files.stop()
+        state_dir.cleanup()
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'config': vars(args),
+        'results': results
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
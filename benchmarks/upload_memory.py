@@ -0,0 +1,72 @@
+"""Замер пикового потребления памяти при загрузке большого видео.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.upload_memory --size-mb 200
+
+Каждый режим загрузки (stream и spool) выполняется в отдельном процессе,
+потому что ru_maxrss показывает пик за все время жизни процесса.
+"""
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_servers import FakeTelegramFiles, FakeWordPress
+from wp_client import WordPressClient
+
+
+def peak_rss_mb():
+    # В Linux ru_maxrss возвращается в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(mode, size_mb):
+    wordpress = FakeWordPress().start()
+    files = FakeTelegramFiles().start()
+    client = WordPressClient(wordpress.url, "user", "password", upload_mode=mode)
+    try:
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        media = await client.upload_media(files.file_url(size_mb * 1024 * 1024), "video/mp4")
+        elapsed = time.perf_counter() - started
+        assert media, "загрузка не удалась"
+        assert wordpress.media[media.id]['size'] == size_mb * 1024 * 1024, "WordPress получил файл не целиком"
+        return {
+            'mode': mode,
+            'size_mb': size_mb,
+            'seconds': round(elapsed, 2),
+            'peak_rss_before_mb': round(rss_before, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        }
+    finally:
+        await client.close()
+        wordpress.stop()
+        files.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=200)
+    parser.add_argument('--mode', choices=['stream', 'spool'])
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run(args.mode, args.size_mb))))
+        return
+
+    for mode in ('stream', 'spool'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.upload_memory', '--mode', mode, '--size-mb', str(args.size_mb)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output)
+        print(f"{result['mode']:>6}: {result['size_mb']} МБ за {result['seconds']} сек, "
+              f"пик RSS {result['peak_rss_mb']} МБ (до загрузки {result['peak_rss_before_mb']} МБ)")
+
+
+if __name__ == "__main__":
+    main()
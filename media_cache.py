@@ -0,0 +1,101 @@
+import logging
+import sqlite3
+import time
+
+from wp_client import MediaRecord
+
+logger = logging.getLogger(__name__)
+
+
+class MediaDedupeCache:
+    """Постоянный кэш соответствия файлов Telegram загруженным медиа WordPress.
+
+    Запись ищется по file_unique_id Telegram или по SHA-256 содержимого и хранится
+    отдельно для каждого сайта. При превышении max_entries записей сайта удаляются
+    его записи, которые дольше всего не использовались.
+    """
+
+    def __init__(self, path, site, max_entries=10000):
+        self.site = site or ""
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                site TEXT NOT NULL,
+                file_unique_id TEXT NOT NULL,
+                content_hash TEXT,
+                media_id INTEGER NOT NULL,
+                source_url TEXT NOT NULL,
+                mime_type TEXT NOT NULL DEFAULT '',
+                last_used REAL NOT NULL,
+                PRIMARY KEY (site, file_unique_id)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_cache_hash ON media_cache (site, content_hash)")
+        self._db.execute("DROP INDEX IF EXISTS media_cache_last_used")
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_cache_site_last_used ON media_cache (site, last_used)")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _find(self, column, value):
+        row = self._db.execute(
+            f"SELECT file_unique_id, media_id, source_url, mime_type, content_hash "
+            f"FROM media_cache WHERE site = ? AND {column} = ? LIMIT 1",
+            (self.site, value)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self._db.execute(
+            "UPDATE media_cache SET last_used = ? WHERE site = ? AND file_unique_id = ?",
+            (time.time(), self.site, row[0])
+        )
+        self._db.commit()
+        return MediaRecord(id=row[1], source_url=row[2], mime_type=row[3], content_hash=row[4] or "")
+
+    # Поиск медиа по file_unique_id Telegram
+    def get(self, file_unique_id):
+        if not file_unique_id:
+            return None
+        return self._find("file_unique_id", file_unique_id)
+
+    # Поиск медиа по SHA-256 содержимого
+    def get_by_hash(self, content_hash):
+        if not content_hash:
+            return None
+        return self._find("content_hash", content_hash)
+
+    # Сохранение загруженного медиа
+    def put(self, file_unique_id, record):
+        if not file_unique_id or not record:
+            return
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO media_cache "
+            "(site, file_unique_id, content_hash, media_id, source_url, mime_type, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.site, file_unique_id, record.content_hash or None, record.id,
+             record.source_url, record.mime_type, time.time())
+        )
+        self._evict()
+        self._db.commit()
+
+    # Удаление всех записей о медиа, например удаленном из медиатеки WordPress
+    def discard(self, media_id):
+        self._db.execute("DELETE FROM media_cache WHERE site = ? AND media_id = ?", (self.site, media_id))
+        self._db.commit()
+
+    # Удаление давно не использовавшихся записей сверх лимита
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM media_cache WHERE site = ?", (self.site,)).fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM media_cache WHERE rowid IN "
+                "(SELECT rowid FROM media_cache WHERE site = ? ORDER BY last_used LIMIT ?)",
+                (self.site, excess)
+            )
+            logger.info(f"Из кэша медиа удалено записей: {excess}")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+
+from metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupAggregator:
+    """Сборка сообщений медиа-группы в цикле событий бота.
+
+    Telegram присылает альбом отдельными сообщениями с общим media_group_id.
+    Группа считается собранной, когда после последнего сообщения прошло quiet_window
+    секунд, когда в ней набралось max_items элементов (больше в альбоме не бывает)
+    или когда с первого сообщения прошло ttl секунд. Если незавершенных групп больше
+    max_pending, самая старая группа обрабатывается досрочно. Сообщения, пришедшие
+    после обработки группы, собираются в новую группу с тем же media_group_id.
+    """
+
+    def __init__(self, on_complete, quiet_window=5.0, max_items=10, max_pending=100, ttl=60.0):
+        self.on_complete = on_complete
+        self.quiet_window = quiet_window
+        self.max_items = max_items
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.groups = {}
+        self._timers = {}
+        self._deadlines = {}
+        self._tasks = set()
+
+    def pending_count(self):
+        return len(self.groups)
+
+    # Добавление сообщения в группу: group - данные группы из сообщения, item - его медиа
+    def add(self, media_group_id, group, item=None):
+        loop = asyncio.get_running_loop()
+        now = time.time()
+
+        current = self.groups.get(media_group_id)
+        if current is None:
+            while len(self.groups) >= self.max_pending:
+                oldest = min(self.groups, key=lambda key: self.groups[key]['created_at'])
+                logger.warning(f"Слишком много незавершенных медиа-групп, досрочно обрабатываем {oldest}")
+                self.flush(oldest)
+
+            current = {**group, 'media': [], 'created_at': now}
+            self.groups[media_group_id] = current
+            self._deadlines[media_group_id] = loop.call_later(self.ttl, self.flush, media_group_id)
+        elif not current['text'] and group['text']:
+            # Подпись альбома может прийти в любом из сообщений группы
+            current['text'] = group['text']
+            current['entities'] = group.get('entities', [])
+            current['title'] = group['title']
+
+        # После восстановления из снимка Telegram может прислать сообщение группы повторно
+        if item is not None and all(media['message_id'] != item['message_id'] for media in current['media']):
+            current['media'].append(item)
+        current['updated_at'] = now
+
+        timer = self._timers.pop(media_group_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        if len(current['media']) >= self.max_items:
+            self.flush(media_group_id)
+        else:
+            self._timers[media_group_id] = loop.call_later(self.quiet_window, self.flush, media_group_id)
+
+    # Передача собранной группы на обработку
+    def flush(self, media_group_id):
+        for timers in (self._timers, self._deadlines):
+            timer = timers.pop(media_group_id, None)
+            if timer is not None:
+                timer.cancel()
+
+        group = self.groups.pop(media_group_id, None)
+        if group is None:
+            return
+
+        record_stage("album_debounce_wait", time.time() - group['created_at'])
+
+        # Сообщения альбома могут прийти не по порядку
+        group['media'].sort(key=lambda item: item['message_id'])
+        group['message_id'] = min([group['message_id']] + [item['message_id'] for item in group['media']])
+
+        task = asyncio.get_running_loop().create_task(self.on_complete(media_group_id, group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # Снимок незавершенных групп для сохранения на диск при остановке бота
+    def snapshot(self):
+        return {'saved_at': time.time(), 'groups': self.groups}
+
+    # Сброс незавершенных групп без обработки (после сохранения снимка)
+    def clear(self):
+        for timers in (self._timers, self._deadlines):
+            for timer in timers.values():
+                timer.cancel()
+            timers.clear()
+        self.groups = {}
+
+    # Восстановление групп из снимка. Время простоя не засчитывается в ttl, а окно ожидания
+    # начинается заново: оставшиеся сообщения альбома могут прийти сразу после запуска
+    def restore(self, snapshot):
+        loop = asyncio.get_running_loop()
+        now = time.time()
+        downtime = max(0.0, now - snapshot['saved_at'])
+        for media_group_id, group in snapshot['groups'].items():
+            group['created_at'] += downtime
+            group['updated_at'] = now
+            self.groups[media_group_id] = group
+            self._timers[media_group_id] = loop.call_later(self.quiet_window, self.flush, media_group_id)
+            self._deadlines[media_group_id] = loop.call_later(
+                max(0.0, group['created_at'] + self.ttl - now), self.flush, media_group_id
+            )
+        return len(snapshot['groups'])
+
+    # Досрочная обработка всех групп и ожидание завершения обработчиков
+    async def flush_all(self):
+        for media_group_id in list(self.groups):
+            self.flush(media_group_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
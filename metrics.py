@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Gauge:
+    """Текущее значение, которое может как расти, так и уменьшаться.
+
+    Вместо явной установки значения можно передать функцию, которая
+    вызывается при каждом чтении метрики. Если задан label, функция возвращает
+    словарь значений по значению этой метки.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, function=None, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.label = label
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception as e:
+                logger.error(f"Не удалось вычислить метрику {self.name}: {e}")
+                return 0
+        return self.value
+
+    def samples(self):
+        value = self.get()
+        if self.label is not None and isinstance(value, dict):
+            for label_value, item in value.items():
+                yield self.name, ((self.label, label_value),), item
+        else:
+            yield self.name, (), value
+
+
+class Histogram:
+    """Распределение длительностей по корзинам"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][index] += 1
+        series['count'] += 1
+        series['sum'] += value
+
+    # Оценка квантиля по корзинам (верхняя граница корзины, в которую попал квантиль)
+    def quantile(self, share, **labels):
+        series = self.series.get(tuple(sorted(labels.items())))
+        if not series or not series['count']:
+            return None
+
+        rank = share * series['count']
+        for bound, count in zip(self.buckets, series['buckets']):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        for labels, series in self.series.items():
+            for bound, count in zip(self.buckets, series['buckets']):
+                yield f"{self.name}_bucket", labels + (('le', repr(bound)),), count
+            yield f"{self.name}_bucket", labels + (('le', '+Inf'),), series['count']
+            yield f"{self.name}_count", labels, series['count']
+            yield f"{self.name}_sum", labels, series['sum']
+
+
+class Registry:
+    """Набор метрик, отдаваемых в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Этапы публикации: get_file, скачивание из Telegram, загрузка в WordPress,
+# создание поста, ожидание сборки альбома, уведомление администратора
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "tg_wp_stage_duration_seconds", "Длительность этапов публикации"
+))
+STAGE_TOTAL = REGISTRY.register(Counter(
+    "tg_wp_stage_total", "Число выполнений этапов публикации по результату"
+))
+IN_FLIGHT_UPLOADS = REGISTRY.register(Gauge(
+    "tg_wp_in_flight_uploads", "Загрузки медиа, выполняемые прямо сейчас"
+))
+PENDING_MEDIA_GROUPS = REGISTRY.register(Gauge(
+    "tg_wp_pending_media_groups", "Медиа-группы, которые еще собираются"
+))
+OUTBOX_PENDING = REGISTRY.register(Gauge(
+    "tg_wp_outbox_pending_jobs", "Задачи публикации, ожидающие выполнения"
+))
+ADMIN_NOTIFICATIONS_PENDING = REGISTRY.register(Gauge(
+    "tg_wp_admin_notifications_pending", "Уведомления администратору, ожидающие сводки или отправки"
+))
+WP_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "tg_wp_wordpress_concurrency_limit", "Текущий предел одновременных запросов к WordPress", label="site"
+))
+WP_CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    "tg_wp_wordpress_circuit_open", "Запросы к WordPress приостановлены автоматом защиты (1 - да)", label="site"
+))
+
+
+class _StageTimer:
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+# Замер этапа: исключение или вызов fail() учитываются как ошибка
+@contextmanager
+def track_stage(stage):
+    timer = _StageTimer()
+    started = time.perf_counter()
+    try:
+        yield timer
+    except BaseException:
+        timer.failed = True
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        STAGE_TOTAL.inc(stage=stage, outcome="error" if timer.failed else "ok")
+
+
+def record_stage(stage, seconds, failed=False):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    STAGE_TOTAL.inc(stage=stage, outcome="error" if failed else "ok")
+
+
+# Краткая сводка для администратора
+def summary():
+    lines = []
+    for labels, series in sorted(STAGE_SECONDS.series.items()):
+        stage = dict(labels)['stage']
+        errors = STAGE_TOTAL.values.get((('outcome', 'error'), ('stage', stage)), 0)
+        average = series['sum'] / series['count'] if series['count'] else 0
+        p95 = STAGE_SECONDS.quantile(0.95, stage=stage)
+        lines.append(f"{stage}: {series['count']} раз, среднее {average:.2f} с, p95 ≤ {p95} с, ошибок {errors}")
+
+    if not lines:
+        lines.append("Этапы публикации еще не выполнялись.")
+
+    for gauge in (IN_FLIGHT_UPLOADS, PENDING_MEDIA_GROUPS, OUTBOX_PENDING, ADMIN_NOTIFICATIONS_PENDING,
+                  WP_CONCURRENCY_LIMIT, WP_CIRCUIT_OPEN):
+        value = gauge.get()
+        # Метрики с меткой (например, по сайтам) выводятся парами значение_метки=значение
+        if isinstance(value, dict):
+            value = ", ".join(f"{label_value}={item}" for label_value, item in value.items())
+        lines.append(f"{gauge.documentation}: {value}")
+
+    return "\n".join(lines)
+
+
+# Минимальный HTTP-сервер, отдающий метрики по GET /metrics
+async def _handle_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await reader.readline()).strip():
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    try:
+        server = await asyncio.start_server(_handle_request, host, port)
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        return None
+
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryLater(Exception):
+    """Задачу нужно отложить на delay секунд, не засчитывая попытку"""
+
+    def __init__(self, delay, reason=""):
+        super().__init__(reason or f"Задача отложена на {delay:.0f} сек")
+        self.delay = delay
+
+
+class Outbox:
+    """Постоянная очередь задач публикации в SQLite.
+
+    Каждая задача имеет ключ идемпотентности: повторная постановка задачи с тем же
+    ключом игнорируется. Неудачные задачи повторяются с экспоненциальной задержкой,
+    после max_attempts попыток задача попадает в список «мертвых» (status = 'dead').
+    """
+
+    def __init__(self, path, max_attempts=8, base_delay=5.0, max_delay=600.0, poll_interval=5.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._stopping = False
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    # Условие выбора задач по ключу: ключ начинается с prefix и не начинается ни с одного
+    # из префиксов exclude (их задачи выполняют другие обработчики)
+    @staticmethod
+    def _key_filter(prefix, exclude):
+        condition = "substr(key, 1, ?) = ?"
+        params = [len(prefix), prefix]
+        for excluded in exclude:
+            condition += " AND substr(key, 1, ?) != ?"
+            params += [len(excluded), excluded]
+        return condition, params
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # Постановка задачи в очередь, возвращает False, если задача с таким ключом уже есть
+    def enqueue(self, key, payload):
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO outbox (key, payload, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(payload, ensure_ascii=False), now, now, now)
+        )
+        self._db.commit()
+        if cursor.rowcount:
+            self._notify()
+            return True
+
+        logger.info(f"Задача {key} уже есть в очереди, повторная постановка пропущена")
+        return False
+
+    # Захват следующей задачи, срок которой наступил; prefix и exclude ограничивают выбор
+    # задачами с ключами, начинающимися с prefix, но не с exclude. Задачу захватывает тот, чей
+    # UPDATE сменил статус: с той же базой может работать другой процесс, и тогда берется следующая задача
+    def claim(self, prefix="", exclude=()):
+        condition, params = self._key_filter(prefix, exclude)
+        while True:
+            row = self._db.execute(
+                "SELECT key, payload, attempts, progress FROM outbox "
+                f"WHERE status = 'pending' AND next_attempt_at <= ? AND {condition} "
+                "ORDER BY created_at LIMIT 1",
+                (time.time(), *params)
+            ).fetchone()
+            if row is None:
+                return None
+
+            cursor = self._db.execute(
+                "UPDATE outbox SET status = 'running', updated_at = ? WHERE key = ? AND status = 'pending'",
+                (time.time(), row[0])
+            )
+            self._db.commit()
+            if cursor.rowcount:
+                return {
+                    'key': row[0],
+                    'payload': json.loads(row[1]),
+                    'attempts': row[2],
+                    'progress': json.loads(row[3])
+                }
+
+    def get(self, key):
+        row = self._db.execute("SELECT payload, status FROM outbox WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {'key': key, 'payload': json.loads(row[0]), 'status': row[1]}
+
+    # Замена данных задачи, которая еще не начала выполняться, возвращает False, если опоздали
+    def update_payload(self, key, payload):
+        cursor = self._db.execute(
+            "UPDATE outbox SET payload = ?, updated_at = ? WHERE key = ? AND status = 'pending'",
+            (json.dumps(payload, ensure_ascii=False), time.time(), key)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    # Сохранение промежуточного состояния задачи (переживает перезапуск)
+    def save_progress(self, key, progress):
+        self._db.execute(
+            "UPDATE outbox SET progress = ?, updated_at = ? WHERE key = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), key)
+        )
+        self._db.commit()
+
+    def complete(self, key):
+        self._db.execute(
+            "UPDATE outbox SET status = 'done', last_error = NULL, updated_at = ? WHERE key = ?",
+            (time.time(), key)
+        )
+        self._db.commit()
+
+    # Учет неудачной попытки, возвращает новый статус задачи ('pending' или 'dead')
+    def fail(self, key, error):
+        attempts = self._db.execute("SELECT attempts FROM outbox WHERE key = ?", (key,)).fetchone()[0] + 1
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = 'dead', now
+        else:
+            status = 'pending'
+            next_attempt_at = now + min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+        self._db.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+            "WHERE key = ?",
+            (status, attempts, next_attempt_at, str(error), now, key)
+        )
+        self._db.commit()
+        return status
+
+    # Откладывание задачи без учета попытки
+    def postpone(self, key, delay, reason=None):
+        now = time.time()
+        self._db.execute(
+            "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, updated_at = ? WHERE key = ?",
+            (now + delay, reason, now, key)
+        )
+        self._db.commit()
+
+    # Возврат задачи в очередь без учета попытки (например, при остановке бота)
+    def release(self, key):
+        self._db.execute(
+            "UPDATE outbox SET status = 'pending', updated_at = ? WHERE key = ? AND status = 'running'",
+            (time.time(), key)
+        )
+        self._db.commit()
+
+    # Задачи, прерванные перезапуском, снова становятся доступными
+    def reset_running(self, prefix="", exclude=()):
+        condition, params = self._key_filter(prefix, exclude)
+        cursor = self._db.execute(
+            f"UPDATE outbox SET status = 'pending' WHERE status = 'running' AND {condition}", params
+        )
+        self._db.commit()
+        return cursor.rowcount
+
+    # Задачи, для которых закончились попытки, от последних к первым
+    def dead_letters(self, limit=50):
+        rows = self._db.execute(
+            "SELECT key, attempts, last_error FROM outbox WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [{'key': key, 'attempts': attempts, 'last_error': last_error} for key, attempts, last_error in rows]
+
+    # Возврат «мертвой» задачи (или всех, если key не указан) в очередь с новым счетчиком попыток.
+    # Прогресс задачи сохраняется, поэтому уже выполненные шаги не повторяются
+    def requeue(self, key=None):
+        now = time.time()
+        condition, params = ("key = ?", [key]) if key is not None else ("1", [])
+        cursor = self._db.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+            f"WHERE status = 'dead' AND {condition}",
+            (now, now, *params)
+        )
+        self._db.commit()
+        if cursor.rowcount:
+            self._notify()
+        return cursor.rowcount
+
+    def pending_count(self, prefix="", exclude=()):
+        condition, params = self._key_filter(prefix, exclude)
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'running') AND {condition}", params
+        ).fetchone()[0]
+
+    # Сколько секунд до ближайшей отложенной задачи
+    def _next_due_in(self, prefix="", exclude=()):
+        condition, params = self._key_filter(prefix, exclude)
+        row = self._db.execute(
+            f"SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending' AND {condition}", params
+        ).fetchone()
+        if row[0] is None:
+            return self.poll_interval
+        return max(0.0, min(row[0] - time.time(), self.poll_interval))
+
+    # Обработчик очереди: handler(job) выполняет задачу и бросает исключение при неудаче,
+    # on_dead(job, error) вызывается, когда попытки закончились
+    async def worker(self, handler, on_dead=None, prefix="", exclude=()):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+
+        while not self._stopping:
+            job = None
+            try:
+                job = self.claim(prefix, exclude)
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_due_in(prefix, exclude))
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                await self._run_job(handler, on_dead, job)
+            except Exception as e:
+                # Ошибка базы (например, «database is locked») не останавливает обработчик
+                logger.error(f"Ошибка очереди публикации: {e}, повтор через {self.poll_interval:.0f} сек")
+                self._recover(job)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run_job(self, handler, on_dead, job):
+        try:
+            await handler(job)
+        except asyncio.CancelledError:
+            self.release(job['key'])
+            raise
+        except RetryLater as e:
+            logger.info(f"Задача {job['key']} отложена на {e.delay:.0f} сек: {e}")
+            self.postpone(job['key'], e.delay, str(e))
+        except Exception as e:
+            status = self.fail(job['key'], e)
+            logger.error(f"Ошибка выполнения задачи {job['key']} (попытка {job['attempts'] + 1}): {e}")
+            if status == 'dead' and on_dead is not None:
+                await on_dead(job, e)
+        else:
+            self.complete(job['key'])
+
+    # Откат незавершенной транзакции и возврат захваченной задачи в очередь после ошибки.
+    # Повторное выполнение безопасно: обработчик продолжает задачу по сохраненному прогрессу
+    def _recover(self, job):
+        try:
+            self._db.rollback()
+            if job is not None:
+                self.release(job['key'])
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось вернуть задачу в очередь, она продолжится после перезапуска: {e}")
+
+    # Запуск пула обработчиков, возвращает список задач asyncio.
+    # Пулы с разными prefix выполняют задачи разных сайтов независимо друг от друга.
+    # Обработчик, завершившийся из-за непредвиденной ошибки, перезапускается
+    def start_workers(self, handler, on_dead=None, concurrency=4, prefix="", exclude=()):
+        self._stopping = False
+        restored = self.reset_running(prefix, exclude)
+        if restored:
+            logger.info(f"Возобновлено незавершенных задач публикации: {restored}")
+
+        tasks = []
+
+        def spawn():
+            task = asyncio.create_task(self.worker(handler, on_dead, prefix, exclude))
+            task.add_done_callback(restart)
+            tasks.append(task)
+
+        def restart(task):
+            if task.cancelled() or task.exception() is None:
+                return
+            logger.error(f"Обработчик очереди публикации аварийно завершился: {task.exception()!r}")
+            tasks.remove(task)
+            if not self._stopping:
+                spawn()
+
+        for _ in range(concurrency):
+            spawn()
+        return tasks
+
+    # Остановка обработчиков: начатые задачи выполняются до конца, новые не берутся.
+    # Обработчики, не успевшие за timeout секунд, отменяются, а их задачи возвращаются в очередь
+    async def stop_workers(self, tasks, timeout=None):
+        self._stopping = True
+        self._notify()
+        if not tasks:
+            return
+
+        _, unfinished = await asyncio.wait(tasks, timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if unfinished:
+            logger.warning(f"Прервано задач публикации при остановке: {len(unfinished)}, они продолжатся после запуска")
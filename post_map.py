@@ -0,0 +1,84 @@
+import json
+import sqlite3
+import time
+
+
+class PostMap:
+    """Постоянное соответствие сообщений Telegram опубликованным постам WordPress.
+
+    Для каждой публикации хранятся ID поста, данные задачи, по которым пост был
+    собран, и загруженные медиа. Этого достаточно, чтобы при редактировании
+    сообщения обновить пост, не загружая медиа заново.
+    """
+
+    def __init__(self, path, site):
+        self.site = site or ""
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS post_map (
+                site TEXT NOT NULL,
+                key TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                post_id INTEGER NOT NULL,
+                link TEXT,
+                payload TEXT NOT NULL,
+                media TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'published',
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (site, key)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS post_map_message ON post_map (site, chat_id, message_id)")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    # Сохранение публикации: payload - данные задачи, media - список словарей загруженных медиа
+    def save(self, key, payload, post_id, link, media, status='published'):
+        self._db.execute(
+            "INSERT OR REPLACE INTO post_map "
+            "(site, key, chat_id, message_id, post_id, link, payload, media, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.site, key, payload['chat_id'], payload['message_id'], post_id, link,
+             json.dumps(payload, ensure_ascii=False), json.dumps(media, ensure_ascii=False), status, time.time())
+        )
+        self._db.commit()
+
+    def _row_to_dict(self, row):
+        if row is None:
+            return None
+        key, post_id, link, payload, media, status = row
+        return {
+            'key': key,
+            'post_id': post_id,
+            'link': link,
+            'payload': json.loads(payload),
+            'media': json.loads(media),
+            'status': status
+        }
+
+    def get(self, key):
+        row = self._db.execute(
+            "SELECT key, post_id, link, payload, media, status FROM post_map WHERE site = ? AND key = ?",
+            (self.site, key)
+        ).fetchone()
+        return self._row_to_dict(row)
+
+    # Поиск публикации по ID сообщения (для альбома - по ID его первого сообщения)
+    def find_by_message(self, chat_id, message_id):
+        row = self._db.execute(
+            "SELECT key, post_id, link, payload, media, status FROM post_map "
+            "WHERE site = ? AND chat_id = ? AND message_id = ?",
+            (self.site, chat_id, message_id)
+        ).fetchone()
+        return self._row_to_dict(row)
+
+    def set_status(self, key, status):
+        self._db.execute(
+            "UPDATE post_map SET status = ?, updated_at = ? WHERE site = ? AND key = ?",
+            (status, time.time(), self.site, key)
+        )
+        self._db.commit()
@@ -0,0 +1,227 @@
+import re
+from html import escape
+from string import Template
+
+# Шаблоны блоков Gutenberg, компилируются один раз при импорте модуля
+POST_TEMPLATE = Template(
+    '<!-- wp:group {"className":"telegram-post"} -->\n'
+    '<div class="wp-block-group telegram-post">$body</div>\n'
+    '<!-- /wp:group -->'
+)
+TELEGRAM_LINK_TEMPLATE = Template(
+    '<!-- wp:paragraph -->\n'
+    '<p><a href="$url" class="telegram-link">Перейти в Telegram</a></p>\n'
+    '<!-- /wp:paragraph -->'
+)
+IMAGE_TEMPLATE = Template(
+    '<!-- wp:image {"id":$id,"sizeSlug":"large","linkDestination":"none"} -->\n'
+    '<figure class="wp-block-image size-large"><img src="$src" alt="" class="wp-image-$id"/></figure>\n'
+    '<!-- /wp:image -->'
+)
+VIDEO_TEMPLATE = Template(
+    '<!-- wp:video {"id":$id} -->\n'
+    '<figure class="wp-block-video"><video controls src="$src"></video></figure>\n'
+    '<!-- /wp:video -->'
+)
+GALLERY_TEMPLATE = Template(
+    '<!-- wp:gallery {"linkTo":"none"} -->\n'
+    '<figure class="wp-block-gallery has-nested-images columns-default is-cropped">$images</figure>\n'
+    '<!-- /wp:gallery -->'
+)
+
+PARAGRAPH_OPEN = '<!-- wp:paragraph -->\n<p>'
+PARAGRAPH_CLOSE = '</p>\n<!-- /wp:paragraph -->\n'
+
+# Открывающий и закрывающий HTML для строчных сущностей Telegram
+INLINE_TAGS = {
+    'bold': ('<strong>', '</strong>'),
+    'italic': ('<em>', '</em>'),
+    'underline': ('<u>', '</u>'),
+    'strikethrough': ('<s>', '</s>'),
+    'spoiler': ('<span class="tg-spoiler">', '</span>'),
+    'code': ('<code>', '</code>'),
+}
+# Ссылки: адрес берется из сущности или из самого текста
+LINK_TYPES = ('text_link', 'url', 'mention', 'email', 'phone_number')
+# Блочные сущности становятся отдельными блоками, если не вложены в другие сущности
+BLOCK_TEMPLATES = {
+    'pre': ('<!-- wp:code -->\n<pre class="wp-block-code"><code>', '</code></pre>\n<!-- /wp:code -->\n'),
+    'blockquote': ('<!-- wp:quote -->\n<blockquote class="wp-block-quote"><p>', '</p></blockquote>\n<!-- /wp:quote -->\n'),
+    'expandable_blockquote': ('<!-- wp:quote -->\n<blockquote class="wp-block-quote"><p>', '</p></blockquote>\n<!-- /wp:quote -->\n'),
+}
+# Вложенные блочные сущности выводятся строчными тегами
+NESTED_BLOCK_TAGS = {
+    'pre': ('<code>', '</code>'),
+    'blockquote': ('<q>', '</q>'),
+    'expandable_blockquote': ('<q>', '</q>'),
+}
+SUPPORTED_TYPES = set(INLINE_TAGS) | set(LINK_TYPES) | set(BLOCK_TEMPLATES)
+
+PARAGRAPH_BREAK = re.compile(r'\n{2,}')
+
+
+def _link_href(entity, text):
+    kind = entity['type']
+    if kind == 'text_link':
+        return entity.get('url', '')
+    if kind == 'mention':
+        return f"https://t.me/{text.lstrip('@')}"
+    if kind == 'email':
+        return f"mailto:{text}"
+    if kind == 'phone_number':
+        return f"tel:{text}"
+    if '://' not in text:
+        return f"http://{text}"
+    return text
+
+
+class _Renderer:
+    """Один проход по тексту: сущности открываются и закрываются на своих границах,
+    открытые теги хранятся в стеке.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.parts = []
+        self.stack = []
+        self.in_paragraph = False
+        self.block = None
+
+    def segment(self, start, end):
+        return self.data[start * 2:end * 2].decode('utf-16-le', errors='replace')
+
+    def open_paragraph(self):
+        if not self.in_paragraph:
+            self.parts.append(PARAGRAPH_OPEN)
+            self.in_paragraph = True
+
+    def close_paragraph(self):
+        if self.in_paragraph:
+            # Переносы строк в конце абзаца не нужны
+            while self.parts[-1].endswith('<br>'):
+                self.parts[-1] = self.parts[-1][:-4]
+            self.parts.append(PARAGRAPH_CLOSE)
+            self.in_paragraph = False
+
+    def open(self, entity, end):
+        kind = entity['type']
+        if kind in BLOCK_TEMPLATES and not self.stack:
+            self.close_paragraph()
+            opening, closing = BLOCK_TEMPLATES[kind]
+            self.block = kind
+        else:
+            if not self.stack and self.block is None:
+                self.open_paragraph()
+            if kind in LINK_TYPES:
+                href = _link_href(entity, self.segment(entity['offset'], end))
+                opening, closing = f'<a href="{escape(href)}">', '</a>'
+            elif kind in NESTED_BLOCK_TAGS:
+                opening, closing = NESTED_BLOCK_TAGS[kind]
+            else:
+                opening, closing = INLINE_TAGS[kind]
+
+        self.parts.append(opening)
+        self.stack.append((end, closing, entity))
+
+    def close(self):
+        end, closing, entity = self.stack.pop()
+        self.parts.append(closing)
+        if not self.stack and self.block is not None:
+            self.block = None
+
+    def text(self, value):
+        if not value:
+            return
+
+        if self.block == 'pre':
+            self.parts.append(escape(value, quote=False))
+            return
+
+        if self.stack or self.block is not None:
+            self.parts.append(escape(value, quote=False).replace('\n', '<br>'))
+            return
+
+        # Текст вне сущностей делится на абзацы по пустым строкам
+        for index, chunk in enumerate(PARAGRAPH_BREAK.split(value)):
+            if index:
+                self.close_paragraph()
+            if not self.in_paragraph:
+                chunk = chunk.lstrip('\n')
+            if chunk:
+                self.open_paragraph()
+                self.parts.append(escape(chunk, quote=False).replace('\n', '<br>'))
+
+
+# Преобразование текста сообщения с сущностями Telegram (entity.to_dict()) в блоки Gutenberg.
+# Смещения сущностей заданы в кодовых единицах UTF-16
+def render_text(text, entities=None):
+    if not text:
+        return ""
+
+    data = text.encode('utf-16-le')
+    size = len(data) // 2
+    entities = sorted(
+        (entity for entity in entities or () if entity['type'] in SUPPORTED_TYPES and entity['length'] > 0),
+        key=lambda entity: (entity['offset'], -entity['length'])
+    )
+
+    renderer = _Renderer(data)
+    boundaries = sorted({0, size} | {min(entity['offset'] + entity['length'], size) for entity in entities}
+                        | {entity['offset'] for entity in entities if entity['offset'] < size})
+    next_entity = 0
+
+    for position, next_position in zip(boundaries, boundaries[1:] + [size]):
+        # Закрываем сущности, которые здесь заканчиваются. Если сущность пересекается
+        # с вложенной в нее, вложенная закрывается и открывается снова
+        if any(end <= position for end, _, _ in renderer.stack):
+            reopen = []
+            while any(end <= position for end, _, _ in renderer.stack):
+                end, _, entity = renderer.stack[-1]
+                renderer.close()
+                if end > position:
+                    reopen.append((entity, end))
+            for entity, end in reversed(reopen):
+                renderer.open(entity, end)
+
+        while next_entity < len(entities) and entities[next_entity]['offset'] == position:
+            entity = entities[next_entity]
+            renderer.open(entity, min(entity['offset'] + entity['length'], size))
+            next_entity += 1
+
+        if next_position > position:
+            renderer.text(renderer.segment(position, next_position))
+
+    while renderer.stack:
+        renderer.close()
+    renderer.close_paragraph()
+    return "".join(renderer.parts).rstrip('\n')
+
+
+# Блоки медиа: фото альбома собираются в галерею, видео и одиночные фото идут отдельными блоками.
+# media - пары (тип медиа, MediaRecord)
+def render_media(media, gallery=False):
+    images = []
+    videos = []
+    for media_type, record in media:
+        if not record.source_url:
+            continue
+        values = {'id': int(record.id), 'src': escape(record.source_url)}
+        if media_type == 'photo':
+            images.append(IMAGE_TEMPLATE.substitute(values))
+        else:
+            videos.append(VIDEO_TEMPLATE.substitute(values))
+
+    blocks = []
+    if gallery and images:
+        blocks.append(GALLERY_TEMPLATE.substitute(images="\n" + "\n".join(images) + "\n"))
+    else:
+        blocks.extend(images)
+    blocks.extend(videos)
+    return "\n".join(blocks)
+
+
+# Полная разметка поста: медиа, текст и ссылка на оригинал в Telegram
+def render_post(text, entities, channel_username, message_id, media=(), gallery=False):
+    link = TELEGRAM_LINK_TEMPLATE.substitute(url=escape(f"https://t.me/{channel_username}/{message_id}"))
+    blocks = [render_media(media, gallery), render_text(text, entities), link]
+    return POST_TEMPLATE.substitute(body="\n" + "\n".join(block for block in blocks if block) + "\n")
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import re
+
+from media_cache import MediaDedupeCache
+from post_map import PostMap
+from wp_client import WordPressClient
+from wp_guard import AdaptiveConcurrencyLimiter, CircuitBreaker, TokenBucket, WordPressGuard
+
+logger = logging.getLogger(__name__)
+
+TARGET_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# Префикс ключей задач импорта истории: их выполняют только обработчики команды backfill
+BACKFILL_KEY_PREFIX = "backfill:"
+
+
+class ConfigError(Exception):
+    """Ошибка в файле настроек каналов и сайтов"""
+
+
+class PublishTarget:
+    """Сайт WordPress со своими клиентом и пулом соединений, защитой от перегрузки,
+    кэшем медиа и числом обработчиков очереди. Медленный или недоступный сайт
+    не задерживает публикации на остальные сайты.
+
+    key_prefix добавляется к ключам задач в общей очереди, по нему обработчики
+    выбирают задачи своего сайта. У сайта по умолчанию префикс пустой, как у
+    задач, поставленных в очередь до настройки нескольких сайтов.
+    """
+
+    def __init__(self, name, url, username, password, state_path, settings, key_prefix=""):
+        self.name = name
+        self.url = url
+        self.key_prefix = key_prefix
+        self.workers = int(settings['workers'])
+        self.guard = WordPressGuard(
+            bucket=TokenBucket(rate=float(settings['rate_limit']), burst=int(settings['rate_burst'])),
+            limiter=AdaptiveConcurrencyLimiter(
+                initial=int(settings['concurrency_initial']),
+                maximum=int(settings['concurrency_max']),
+                latency_target=float(settings['latency_target'])
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(settings['breaker_threshold']),
+                reset_timeout=float(settings['breaker_reset']),
+                max_reset_timeout=float(settings['breaker_max_reset'])
+            )
+        )
+        self.client = WordPressClient(
+            url,
+            username,
+            password,
+            max_connections=int(settings['max_connections']),
+            max_keepalive_connections=int(settings['max_keepalive_connections']),
+            timeout=float(settings['timeout']),
+            connect_timeout=float(settings['connect_timeout']),
+            ready_timeout=float(settings['media_ready_timeout']),
+            ready_initial_delay=float(settings['media_ready_initial_delay']),
+            ready_max_delay=float(settings['media_ready_max_delay']),
+            upload_mode=settings['upload_mode'],
+            chunk_size=int(settings['upload_chunk_size']),
+            media_cache_ttl=float(settings['media_cache_ttl']),
+            guard=self.guard
+        )
+        self.media_cache = MediaDedupeCache(state_path, url, max_entries=int(settings['media_cache_max_entries']))
+        self.post_map = PostMap(state_path, url)
+        self.upload_semaphore = asyncio.Semaphore(int(settings['upload_concurrency']))
+
+    def job_key(self, key):
+        return self.key_prefix + key
+
+    async def close(self):
+        await self.client.close()
+        self.media_cache.close()
+        self.post_map.close()
+
+
+class Route:
+    """Публикация из канала на сайт: постоянные рубрики и метки поста и рубрики
+    и метки по хэштегам сообщения (хэштеги указываются без # в нижнем регистре)
+    """
+
+    def __init__(self, target, categories=(), tags=(), hashtag_categories=None, hashtag_tags=None):
+        self.target = target
+        self.categories = list(categories)
+        self.tags = list(tags)
+        self.hashtag_categories = {key.lower().lstrip('#'): value for key, value in (hashtag_categories or {}).items()}
+        self.hashtag_tags = {key.lower().lstrip('#'): value for key, value in (hashtag_tags or {}).items()}
+
+    # Рубрики и метки поста по тексту сообщения и его сущностям
+    def taxonomy(self, text, entities):
+        categories = list(self.categories)
+        tags = list(self.tags)
+        if self.hashtag_categories or self.hashtag_tags:
+            encoded = text.encode('utf-16-le')
+            for entity in entities or ():
+                if entity['type'] != 'hashtag':
+                    continue
+                start = entity['offset'] * 2
+                hashtag = encoded[start:start + entity['length'] * 2].decode('utf-16-le', errors='replace')
+                hashtag = hashtag.lstrip('#').lower()
+                if hashtag in self.hashtag_categories:
+                    categories.append(self.hashtag_categories[hashtag])
+                if hashtag in self.hashtag_tags:
+                    tags.append(self.hashtag_tags[hashtag])
+        return sorted(set(categories)), sorted(set(tags))
+
+
+# Чтение файла настроек: YAML или TOML (по расширению)
+def load_config(path):
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+
+    try:
+        import yaml
+    except ImportError:
+        raise ConfigError("Для файла настроек в формате YAML установите PyYAML: pip install PyYAML")
+    with open(path, encoding='utf-8') as file:
+        return yaml.safe_load(file) or {}
+
+
+# Создание сайтов и маршрутов из настроек. defaults - значения по умолчанию
+# (из переменных окружения), их можно переопределить в секции defaults и для каждого сайта.
+# Возвращает словарь сайтов по имени и словарь маршрутов по ID канала
+def build_targets(config, state_path, defaults):
+    defaults = {**defaults, **(config.get('defaults') or {})}
+
+    targets = {}
+    default_sites = [name for name, site in (config.get('sites') or {}).items() if site.get('default')]
+    if len(default_sites) > 1:
+        raise ConfigError(f"Параметр default указан у нескольких сайтов: {', '.join(default_sites)}")
+
+    for name, site in (config.get('sites') or {}).items():
+        if not TARGET_NAME.match(name) or f"{name}:" == BACKFILL_KEY_PREFIX:
+            raise ConfigError(f"Недопустимое имя сайта {name!r}: используйте латиницу, цифры, _ и -")
+        if not site.get('url') or not site.get('username'):
+            raise ConfigError(f"Для сайта {name} нужно указать url и username")
+
+        # Пароль лучше хранить в переменной окружения, а не в файле настроек
+        password = site.get('password') or os.getenv(site.get('password_env') or '')
+        if not password:
+            raise ConfigError(f"Для сайта {name} не задан password или password_env")
+
+        settings = {**defaults, **{key: value for key, value in site.items() if key in defaults}}
+        # Сайт по умолчанию продолжает задачи и правки постов, опубликованных без файла настроек
+        targets[name] = PublishTarget(name, site['url'], site['username'], password, state_path, settings,
+                                      key_prefix="" if site.get('default') else f"{name}:")
+
+    routes = {}
+    for channel in config.get('channels') or []:
+        chat_id = str(channel['id'])
+        for route in channel.get('targets') or []:
+            if isinstance(route, str):
+                route = {'site': route}
+            if route.get('site') not in targets:
+                raise ConfigError(f"Канал {chat_id} ссылается на неизвестный сайт {route.get('site')!r}")
+            routes.setdefault(chat_id, []).append(Route(
+                targets[route['site']],
+                categories=route.get('categories') or (),
+                tags=route.get('tags') or (),
+                hashtag_categories=route.get('hashtag_categories'),
+                hashtag_tags=route.get('hashtag_tags')
+            ))
+
+    if not routes:
+        raise ConfigError("В настройках нет ни одного канала с сайтами")
+    return targets, routes
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Типы фрагментов текста в экспорте Telegram Desktop, которые называются иначе, чем сущности Bot API
+EXPORT_ENTITY_TYPES = {
+    'link': 'url',
+    'phone': 'phone_number',
+    'mention_name': 'text_mention',
+}
+
+# Фото и видео в экспорте; остальные файлы (документы, голосовые, стикеры) не публикуются
+VIDEO_MEDIA_TYPES = ('video_file',)
+
+
+def _utf16_length(value):
+    return len(value.encode('utf-16-le')) // 2
+
+
+# Загрузка экспорта: path - папка экспорта или путь к result.json
+def load_export(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, 'result.json')
+    with open(path, encoding='utf-8') as file:
+        export = json.load(file)
+    export['base_dir'] = os.path.dirname(os.path.abspath(path))
+    return export
+
+
+# ID канала в Bot API: к ID из экспорта добавляется префикс -100
+def export_chat_id(export):
+    return int(f"-100{export['id']}")
+
+
+# Текст сообщения и сущности в формате entity.to_dict() со смещениями в UTF-16
+def message_text(message):
+    parts = message.get('text_entities')
+    if parts is None:
+        raw = message.get('text') or ""
+        parts = raw if isinstance(raw, list) else [raw]
+        parts = [part if isinstance(part, dict) else {'type': 'plain', 'text': part} for part in parts]
+
+    text = []
+    entities = []
+    offset = 0
+    for part in parts:
+        value = part.get('text') or ""
+        length = _utf16_length(value)
+        kind = EXPORT_ENTITY_TYPES.get(part['type'], part['type'])
+        if kind != 'plain' and length:
+            entity = {'type': kind, 'offset': offset, 'length': length}
+            if part.get('href'):
+                entity['url'] = part['href']
+            if part.get('language'):
+                entity['language'] = part['language']
+            entities.append(entity)
+        text.append(value)
+        offset += length
+
+    return "".join(text), entities
+
+
+# Медиа сообщения: фото или видео из локальной папки экспорта
+def message_media(message, base_dir):
+    if message.get('photo'):
+        media_type, relative_path, mime_type = 'photo', message['photo'], 'image/jpeg'
+    elif message.get('media_type') in VIDEO_MEDIA_TYPES and message.get('file'):
+        media_type, relative_path, mime_type = 'video', message['file'], message.get('mime_type') or 'video/mp4'
+    else:
+        return None
+
+    # Файлы, которые не выгружались, отмечены строкой вида "(File not included...)"
+    path = os.path.join(base_dir, relative_path)
+    if relative_path.startswith('(') or not os.path.isfile(path):
+        logger.warning(f"Файл сообщения {message['id']} отсутствует в экспорте: {relative_path}")
+        return None
+
+    return {'type': media_type, 'path': path, 'mime_type': mime_type, 'message_id': message['id']}
+
+
+# Публикации из экспорта по порядку. В экспорте нет media_group_id, поэтому альбомом
+# считаются идущие подряд сообщения с медиа и одинаковым временем отправки
+def export_posts(export):
+    post = None
+    for message in export.get('messages', []):
+        if message.get('type') != 'message':
+            continue
+
+        text, entities = message_text(message)
+        item = message_media(message, export['base_dir'])
+        if not text and not item:
+            continue
+
+        if post is not None and item and post['media'] and post['date'] == message['date']:
+            post['media'].append(item)
+            post['album'] = True
+            if not post['text'] and text:
+                post['text'], post['entities'] = text, entities
+            continue
+
+        if post is not None:
+            yield post
+        post = {
+            'message_id': message['id'],
+            'date': message['date'],
+            'text': text,
+            'entities': entities,
+            'media': [item] if item else [],
+            'album': False
+        }
+
+    if post is not None:
+        yield post
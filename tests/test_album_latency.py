@@ -0,0 +1,9 @@
+import asyncio
+
+from benchmarks.album_latency import check, run
+
+
+# Раньше каждая загрузка ждала фиксированные 2 секунды; время на элемент должно
+# определяться только задержкой сервера и готовностью медиа
+def test_album_latency_has_no_fixed_sleep():
+    check(asyncio.run(run([1, 5, 10], ready_after=0.1, latency=0.01)))
@@ -0,0 +1,518 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import httpx
+from dataclasses import dataclass, field
+from datetime import datetime
+from metrics import record_stage, track_stage
+from wp_guard import CircuitOpenError, WordPressGuard
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MediaRecord:
+    """Сведения о загруженном медиа, которые нужны для сборки поста"""
+    id: int
+    source_url: str
+    mime_type: str = ""
+    sizes: dict = field(default_factory=dict)
+    # SHA-256 содержимого файла, известен только для медиа, загруженных этим клиентом
+    content_hash: str = ""
+
+    @classmethod
+    def from_json(cls, media):
+        details = media.get('media_details') or {}
+        return cls(
+            id=media['id'],
+            source_url=media.get('source_url') or "",
+            mime_type=media.get('mime_type') or "",
+            sizes={name: size.get('source_url') for name, size in (details.get('sizes') or {}).items()}
+        )
+
+
+class TTLCache:
+    """Небольшой кэш в памяти с ограниченным временем жизни записей"""
+
+    def __init__(self, ttl=300.0, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = {}
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+
+        expires, value = item
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+
+        return value
+
+    def set(self, key, value):
+        if len(self._items) >= self.max_size and key not in self._items:
+            # Удаляем самую старую запись (словарь хранит порядок вставки)
+            del self._items[next(iter(self._items))]
+        self._items[key] = (time.monotonic() + self.ttl, value)
+
+
+class WordPressClient:
+    """Асинхронный клиент WordPress REST API с общим пулом keep-alive соединений"""
+
+    def __init__(self, base_url, username, password, max_connections=10,
+                 max_keepalive_connections=5, timeout=30.0, connect_timeout=10.0,
+                 ready_timeout=10.0, ready_initial_delay=0.2, ready_max_delay=2.0,
+                 upload_mode="stream", chunk_size=256 * 1024, media_cache_ttl=300.0, guard=None):
+        self.base_url = (base_url or "").rstrip('/')
+        self.api_url = f"{self.base_url}/wp-json/wp/v2"
+        self.auth = httpx.BasicAuth(username or "", password or "")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        # Параметры ожидания готовности загруженного медиа
+        self.ready_timeout = ready_timeout
+        self.ready_initial_delay = ready_initial_delay
+        self.ready_max_delay = ready_max_delay
+        # stream - файл передается из Telegram в WordPress по частям,
+        # spool - файл сначала сбрасывается во временный файл, чтобы отправить точный Content-Length
+        if upload_mode not in ("stream", "spool"):
+            raise ValueError(f"Неизвестный режим загрузки медиа: {upload_mode}")
+        self.upload_mode = upload_mode
+        self.chunk_size = chunk_size
+        self.media_cache = TTLCache(ttl=media_cache_ttl)
+        # Ограничение частоты, адаптивная конкурентность и автомат защиты для всех запросов
+        self.guard = guard or WordPressGuard()
+        self._client = None
+        self._download_client = None
+
+    @property
+    def client(self):
+        # Клиент создается лениво, чтобы привязаться к циклу событий бота
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                follow_redirects=True
+            )
+        return self._client
+
+    @property
+    def download_client(self):
+        # Файлы Telegram скачиваются отдельным клиентом: иначе при загрузке скачивание и запрос
+        # к WordPress занимали бы два соединения из пула сайта, и скачивания могли занять его целиком
+        if self._download_client is None or self._download_client.is_closed:
+            self._download_client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                follow_redirects=True
+            )
+        return self._download_client
+
+    async def close(self):
+        for client in (self._client, self._download_client):
+            if client is not None and not client.is_closed:
+                await client.aclose()
+        self._client = None
+        self._download_client = None
+
+    # Получение сведений о медиа по ID с кэшированием
+    async def get_media(self, media_id):
+        record = self.media_cache.get(media_id)
+        if record is not None:
+            return record
+
+        media_info = await self.get_media_info(media_id)
+        if not media_info:
+            return None
+
+        record = MediaRecord.from_json(media_info)
+        self.media_cache.set(media_id, record)
+        return record
+
+    # Проверка, что медиа еще есть в медиатеке WordPress. False возвращается, только если
+    # WordPress ответил, что такого медиа нет; при других ошибках медиа считается существующим
+    async def media_exists(self, media_id):
+        if self.media_cache.get(media_id) is not None:
+            return True
+
+        try:
+            async with self.guard.slot() as slot:
+                response = await self.client.get(f"{self.api_url}/media/{media_id}", auth=self.auth)
+                slot.record(response)
+        except Exception as e:
+            logger.warning(f"Не удалось проверить медиа {media_id}: {e}")
+            return True
+
+        if response.status_code == 200:
+            self.media_cache.set(media_id, MediaRecord.from_json(response.json()))
+            return True
+        return response.status_code not in (404, 410)
+
+    # Получение информации о медиа по ID
+    async def get_media_info(self, media_id):
+        try:
+            async with self.guard.slot() as slot:
+                response = await self.client.get(f"{self.api_url}/media/{media_id}", auth=self.auth)
+                slot.record(response)
+
+            if response.status_code == 200:
+                return response.json()
+
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при получении информации о медиа: {e}")
+            return None
+
+    # Загрузка медиа из Telegram в медиатеку WordPress без буферизации файла в памяти.
+    # find_by_hash - необязательная корутина поиска уже загруженного медиа по SHA-256,
+    # в режиме spool она вызывается до отправки файла в WordPress
+    async def upload_media(self, media_url, mime_type, find_by_hash=None):
+        try:
+            digest = hashlib.sha256()
+
+            file_name = f"telegram_media_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            file_extension = ".jpg" if mime_type == "image/jpeg" else ".mp4"
+
+            media_headers = {
+                "Content-Disposition": f'attachment; filename="{file_name}{file_extension}"',
+                "Content-Type": mime_type
+            }
+
+            # Файл Telegram скачивается без авторизации WordPress.
+            # В режиме stream этап media_download - время до ответа Telegram, а сама передача
+            # файла входит в wp_media_upload; в режиме spool - скачивание во временный файл целиком
+            download_started = time.perf_counter()
+            async with self.download_client.stream("GET", media_url) as media_response:
+                if media_response.status_code != 200:
+                    record_stage("media_download", time.perf_counter() - download_started, failed=True)
+                    logger.error(f"Ошибка скачивания медиа из Telegram: {media_response.status_code}")
+                    return None
+
+                if self.upload_mode == "spool":
+                    with tempfile.TemporaryFile() as spool:
+                        with track_stage("media_download"):
+                            size = await self._spool(media_response, spool, digest)
+
+                        cached = await find_by_hash(digest.hexdigest()) if find_by_hash else None
+                        if cached:
+                            logger.info(f"Медиа с таким содержимым уже загружено: {cached.id}")
+                            return cached
+
+                        media_headers["Content-Length"] = str(size)
+                        with track_stage("wp_media_upload") as upload:
+                            async with self.guard.slot(latency_sensitive=False) as slot:
+                                response = await self.client.post(
+                                    f"{self.api_url}/media",
+                                    headers=media_headers,
+                                    auth=self.auth,
+                                    content=self._iter_file(spool, slot)
+                                )
+                                slot.record(response)
+                            if response.status_code not in [200, 201]:
+                                upload.fail()
+                else:
+                    record_stage("media_download", time.perf_counter() - download_started)
+
+                    # Без Content-Length от Telegram тело уйдет с Transfer-Encoding: chunked
+                    if "Content-Length" in media_response.headers and "Content-Encoding" not in media_response.headers:
+                        media_headers["Content-Length"] = media_response.headers["Content-Length"]
+                    with track_stage("wp_media_upload") as upload:
+                        async with self.guard.slot(latency_sensitive=False) as slot:
+                            response = await self.client.post(
+                                f"{self.api_url}/media",
+                                headers=media_headers,
+                                auth=self.auth,
+                                content=self._iter_hashed(media_response.aiter_bytes(self.chunk_size), digest, slot)
+                            )
+                            slot.record(response)
+                        if response.status_code not in [200, 201]:
+                            upload.fail()
+
+            return await self._finish_upload(response, digest.hexdigest())
+        except CircuitOpenError:
+            # Пусть вызывающий код отложит задачу, а не считает ее неудачной
+            raise
+        except Exception as e:
+            # У таймаутов httpx пустой текст, поэтому в журнал пишется и тип ошибки
+            logger.error(f"Ошибка при загрузке медиа: {type(e).__name__}: {e}")
+            return None
+
+    # Загрузка локального файла (например, из экспорта истории канала), возвращает MediaRecord.
+    # Хэш считается до загрузки, поэтому уже загруженное содержимое не отправляется повторно
+    async def upload_file(self, path, mime_type, find_by_hash=None):
+        try:
+            content_hash = await asyncio.to_thread(self._hash_file, path)
+            cached = await find_by_hash(content_hash) if find_by_hash else None
+            if cached:
+                logger.info(f"Медиа с таким содержимым уже загружено: {cached.id}")
+                return cached
+
+            media_headers = {
+                "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"',
+                "Content-Type": mime_type,
+                "Content-Length": str(os.path.getsize(path))
+            }
+            with open(path, 'rb') as file:
+                with track_stage("wp_media_upload") as upload:
+                    async with self.guard.slot(latency_sensitive=False) as slot:
+                        response = await self.client.post(
+                            f"{self.api_url}/media",
+                            headers=media_headers,
+                            auth=self.auth,
+                            content=self._iter_file(file, slot)
+                        )
+                        slot.record(response)
+                    if response.status_code not in [200, 201]:
+                        upload.fail()
+
+            return await self._finish_upload(response, content_hash)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке файла {path}: {e}")
+            return None
+
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    # Обработка ответа на загрузку медиа: ожидание готовности и сборка MediaRecord
+    async def _finish_upload(self, response, content_hash):
+        if response.status_code in [200, 201]:
+            media = response.json()
+
+            # Ждем, пока WordPress закончит обработку медиа
+            ready_media = await self.wait_until_ready(media)
+            if ready_media is None:
+                logger.warning(f"Медиа {media.get('id')} не обработано за {self.ready_timeout} сек, продолжаем")
+                ready_media = media
+
+            # Ответ на создание медиа уже содержит source_url, отдельный запрос не нужен
+            record = MediaRecord.from_json(ready_media)
+            record.content_hash = content_hash
+            self.media_cache.set(record.id, record)
+            return record
+
+        logger.error(f"Ошибка загрузки медиа в WordPress: {response.status_code}, {response.text}")
+        return None
+
+    # Сброс скачиваемого файла во временный файл, возвращает размер в байтах
+    async def _spool(self, media_response, spool, digest):
+        size = 0
+        async for chunk in media_response.aiter_bytes(self.chunk_size):
+            digest.update(chunk)
+            await asyncio.to_thread(spool.write, chunk)
+            size += len(chunk)
+        await asyncio.to_thread(spool.seek, 0)
+        return size
+
+    # Подсчет SHA-256 по мере передачи частей файла. Ошибка чтения из Telegram отмечается
+    # в slot, чтобы не засчитать ее WordPress
+    @staticmethod
+    async def _iter_hashed(chunks, digest, slot):
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+        except Exception:
+            slot.source_failure()
+            raise
+
+    # Чтение файла по частям для отправки в WordPress
+    async def _iter_file(self, spool, slot):
+        while True:
+            try:
+                chunk = await asyncio.to_thread(spool.read, self.chunk_size)
+            except Exception:
+                slot.source_failure()
+                raise
+            if not chunk:
+                break
+            yield chunk
+
+    # Медиа готово, когда у него есть адрес файла, а у изображений еще и размеры
+    @staticmethod
+    def is_media_ready(media):
+        if not media or not media.get('source_url'):
+            return False
+
+        if media.get('media_type') == 'image':
+            return bool((media.get('media_details') or {}).get('width'))
+
+        return True
+
+    # Ожидание готовности медиа с экспоненциальной задержкой между проверками,
+    # возвращает актуальные данные медиа или None по истечении таймаута
+    async def wait_until_ready(self, media):
+        if self.is_media_ready(media):
+            return media
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.ready_timeout
+        delay = self.ready_initial_delay
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.ready_max_delay)
+
+            media_info = await self.get_media_info(media.get('id'))
+            if self.is_media_ready(media_info):
+                return media_info
+
+    # Создание поста
+    # date - дата публикации в ISO 8601 по времени сайта (для постов из истории канала),
+    # categories и tags - списки ID рубрик и меток
+    async def create_post(self, title, content, featured_media_id=None, date=None, categories=None, tags=None):
+        try:
+            post_data = {
+                "title": title,
+                "content": content,
+                "status": "publish"
+            }
+
+            if featured_media_id:
+                post_data["featured_media"] = featured_media_id
+            if date:
+                post_data["date"] = date
+            if categories:
+                post_data["categories"] = categories
+            if tags:
+                post_data["tags"] = tags
+
+            with track_stage("wp_post_create") as stage:
+                async with self.guard.slot() as slot:
+                    response = await self.client.post(f"{self.api_url}/posts", auth=self.auth, json=post_data)
+                    slot.record(response)
+                if response.status_code != 201:
+                    stage.fail()
+
+            if response.status_code == 201:
+                post = response.json()
+                logger.info(f"Пост успешно создан: {post.get('link')}")
+                return True, post
+
+            logger.error(f"Ошибка создания поста: {response.status_code}, {response.text}")
+            return False, None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при публикации поста: {e}")
+            return False, None
+
+    # Поиск опубликованного поста со ссылкой на сообщение Telegram.
+    # В отличие от остальных методов ошибки не скрываются: если проверить не удалось,
+    # повторное создание поста может привести к дубликату
+    async def find_post_by_link(self, telegram_link):
+        async with self.guard.slot() as slot:
+            response = await self.client.get(
+                f"{self.api_url}/posts",
+                auth=self.auth,
+                params={"search": telegram_link, "per_page": 10, "_fields": "id,link,content"}
+            )
+            slot.record(response)
+        response.raise_for_status()
+
+        for post in response.json():
+            if f'href="{telegram_link}"' in (post.get('content') or {}).get('rendered', ''):
+                return post
+
+        return None
+
+    # Обновление поста: передаются только изменившиеся поля
+    async def update_post(self, post_id, fields):
+        try:
+            with track_stage("wp_post_update") as stage:
+                async with self.guard.slot() as slot:
+                    response = await self.client.post(f"{self.api_url}/posts/{post_id}", auth=self.auth, json=fields)
+                    slot.record(response)
+                if response.status_code != 200:
+                    stage.fail()
+
+            if response.status_code == 200:
+                post = response.json()
+                logger.info(f"Пост обновлен: {post.get('link')}")
+                return post
+
+            logger.error(f"Ошибка обновления поста {post_id}: {response.status_code}, {response.text}")
+            return None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении поста {post_id}: {e}")
+            return None
+
+    # Перемещение поста в корзину (без force пост можно восстановить в админке)
+    async def trash_post(self, post_id):
+        try:
+            async with self.guard.slot() as slot:
+                response = await self.client.delete(f"{self.api_url}/posts/{post_id}", auth=self.auth)
+                slot.record(response)
+
+            if response.status_code == 200:
+                logger.info(f"Пост {post_id} перемещен в корзину")
+                return True
+
+            logger.error(f"Ошибка удаления поста {post_id}: {response.status_code}, {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при удалении поста {post_id}: {e}")
+            return False
+
+    # Проверка доступности REST API
+    async def check_connection(self):
+        try:
+            async with self.guard.slot() as slot:
+                response = await self.client.get(f"{self.base_url}/wp-json")
+                slot.record(response)
+            if response.status_code == 200:
+                logger.info("Соединение с WordPress установлено успешно.")
+                return True
+
+            logger.error(f"Ошибка соединения с WordPress: {response.status_code}")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при подключении к WordPress: {e}")
+            return False
+
+    # Проверка учетных данных: сведения о пользователе, от имени которого публикуются посты
+    async def get_current_user(self):
+        try:
+            async with self.guard.slot() as slot:
+                response = await self.client.get(
+                    f"{self.api_url}/users/me",
+                    auth=self.auth,
+                    params={"_fields": "id,name"}
+                )
+                slot.record(response)
+            if response.status_code == 200:
+                return response.json()
+
+            logger.error(f"WordPress отклонил учетные данные: {response.status_code}, {response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при проверке учетных данных WordPress: {e}")
+            return None
+
+    # Прогрев при запуске: проверка REST API и учетных данных. Запросы users/me выполняются
+    # одновременно, чтобы открыть connections соединений пула заранее, и первые публикации
+    # не тратили время на установку соединения
+    async def warm_up(self, connections=1):
+        if not await self.check_connection():
+            return False
+
+        users = await asyncio.gather(*(self.get_current_user() for _ in range(max(1, connections))))
+        return all(users)
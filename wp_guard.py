@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """WordPress считается недоступным, запрос не отправлялся"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"WordPress временно недоступен, повтор через {retry_after:.0f} сек")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate запросов в секунду с запасом burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    # Пауза по заголовку Retry-After от сервера
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Ограничение числа одновременных запросов по схеме AIMD.
+
+    Пока ответы успешные и быстрые, предел растет примерно на единицу за каждые
+    limit запросов; при перегрузке (429, 503, таймауты, медленные ответы) он
+    уменьшается вдвое, но не чаще одного раза за cooldown секунд.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, latency_target=2.0, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = None
+
+    async def acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    # adjust=False освобождает место, не меняя предел (запрос не дошел до результата)
+    async def release(self, overloaded, latency=None, adjust=True):
+        if adjust:
+            if overloaded or (latency is not None and latency > self.latency_target):
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(self.minimum, self.limit / 2)
+                    logger.warning(f"WordPress перегружен, предел одновременных запросов снижен до {int(self.limit)}")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """Автомат защиты: после failure_threshold ошибок подряд запросы не отправляются
+    reset_timeout секунд, затем пропускается один пробный запрос. Если проба
+    неудачна, пауза удваивается вплоть до max_reset_timeout. Успешные чтения счетчик
+    ошибок не сбрасывают: WordPress может отвечать на GET, но не принимать записи.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, max_reset_timeout=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_request(self):
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                raise CircuitOpenError(self.retry_after())
+            self.state = self.HALF_OPEN
+            logger.info("Проверяем, восстановился ли WordPress")
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError(1.0)
+            self._probe_in_flight = True
+
+    # Запрос не был отправлен (например, отменен), проба не израсходована
+    def cancel_probe(self):
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("WordPress снова доступен")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+        self._probe_in_flight = False
+
+    # Успешное чтение не доказывает, что WordPress снова принимает записи: счетчик ошибок
+    # не сбрасывается, а пробу выполнит следующий запрос
+    def record_read_success(self):
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+        self._probe_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logger.error(f"WordPress недоступен, запросы приостановлены на {self.reset_timeout:.0f} сек")
+
+
+class _Slot:
+    def __init__(self):
+        self.status_code = None
+        self.method = None
+        self.retry_after = None
+        self.source_failed = False
+
+    # Сообщение о результате запроса: код ответа и необязательный Retry-After
+    def record(self, response):
+        self.status_code = response.status_code
+        self.method = response.request.method
+        value = response.headers.get("Retry-After")
+        if value and value.isdigit():
+            self.retry_after = int(value)
+
+    # Ошибка при чтении отправляемых данных (например, файла из Telegram): WordPress
+    # тут ни при чем, и ошибка запроса не считается признаком его перегрузки
+    def source_failure(self):
+        self.source_failed = True
+
+
+class WordPressGuard:
+    """Общая защита WordPress: ограничение частоты, адаптивная конкурентность
+    и автомат защиты для всех запросов клиента.
+    """
+
+    OVERLOAD_CODES = (429, 503)
+    READ_METHODS = ("GET", "HEAD")
+
+    def __init__(self, bucket=None, limiter=None, breaker=None):
+        self.bucket = bucket or TokenBucket(rate=10, burst=20)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    # latency_sensitive=False для загрузки файлов, длительность которых зависит от размера
+    @asynccontextmanager
+    async def slot(self, latency_sensitive=True):
+        self.breaker.before_request()
+        slot = _Slot()
+        overloaded = False
+        latency = None
+        try:
+            await self.bucket.acquire()
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.cancel_probe()
+            raise
+
+        started = time.monotonic()
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            self.breaker.cancel_probe()
+            raise
+        except Exception:
+            if slot.source_failed:
+                self.breaker.cancel_probe()
+            else:
+                # Ошибка сети или таймаут
+                overloaded = True
+                self.breaker.record_failure()
+            raise
+        else:
+            if latency_sensitive:
+                latency = time.monotonic() - started
+            code = slot.status_code or 0
+            overloaded = code in self.OVERLOAD_CODES
+            if slot.retry_after and overloaded:
+                self.bucket.block(slot.retry_after)
+            if code >= 500:
+                self.breaker.record_failure()
+            elif slot.method in self.READ_METHODS:
+                self.breaker.record_read_success()
+            else:
+                self.breaker.record_success()
+        finally:
+            await self.limiter.release(overloaded, latency, adjust=not slot.source_failed)